@@ -14,6 +14,9 @@ if [[ "$SKIP_TEST" != "true" ]]; then
     if [[ "$COVERAGE" == "true" ]]; then
         conda install --yes --quiet pytest-cov
     fi
+    if [[ "$INSTALL_NUMBA" == "true" ]]; then
+        conda install --yes --quiet numba
+    fi
     pip install -q mne
     make install
 fi
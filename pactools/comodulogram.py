@@ -3,15 +3,16 @@ import warnings
 import matplotlib
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.interpolate import interp1d, interp2d
+from scipy.sparse import csr_matrix
 
-from .dar_model.base_dar import BaseDAR
+from .dar_model.base_dar import BaseDAR, ar_spectrum
 from .dar_model.dar import DAR
 from .dar_model.preprocess import multiple_extract_driver
-from .utils.parallel import Parallel, delayed
+from .utils.parallel import Parallel, delayed, effective_n_jobs
 from .utils.progress_bar import ProgressBar
 from .utils.spectrum import Bicoherence, Coherence
-from .utils.maths import norm, argmax_2d, next_power2
+from .utils.maths import norm, argmax_2d, roll, circular_dot
+from .utils.maths import circular_slices
 from .utils.validation import check_array, check_random_state
 from .utils.validation import check_consistent_shape, check_is_fitted
 from .utils.viz import add_colorbar
@@ -650,12 +651,15 @@ def _one_modulation_index(amplitude, phase_preprocessed, norm_a, method, shift,
     Used by PAC method in STANDARD_PAC_METRICS.
     """
     # shift for the surrogate analysis
-    if shift != 0:
-        phase_preprocessed = np.roll(phase_preprocessed, shift)
+    # (the shift is applied inside the computations when possible, to avoid
+    # a copy of the phase for each shift)
+    if shift != 0 and method in ('penny', 'vanwijk'):
+        phase_preprocessed = roll(phase_preprocessed, shift)
 
     # Modulation index as in [Ozkurt & al 2011]
     if method == 'ozkurt':
-        MI = np.abs(np.mean(amplitude * phase_preprocessed))
+        MI = np.abs(circular_dot(amplitude, phase_preprocessed, shift))
+        MI /= amplitude.size
         MI *= np.sqrt(amplitude.size) / norm_a
 
     # Generalized linear models as in [Penny & al 2008] or [van Wijk & al 2015]
@@ -672,10 +676,11 @@ def _one_modulation_index(amplitude, phase_preprocessed, norm_a, method, shift,
 
     # Modulation index as in [Canolty & al 2006]
     elif method == 'canolty':
-        z_array = amplitude * phase_preprocessed
-        MI = np.abs(np.mean(z_array))
+        MI = np.abs(circular_dot(amplitude, phase_preprocessed, shift))
+        MI /= amplitude.size
 
         if ax_special is not None and shift == 0:
+            z_array = amplitude * phase_preprocessed
             ax_special.plot(np.real(z_array), np.imag(z_array))
             ax_special.set_ylabel('Imaginary part of z(t)')
             ax_special.set_xlabel('Real part of z(t)')
@@ -686,10 +691,16 @@ def _one_modulation_index(amplitude, phase_preprocessed, norm_a, method, shift,
     elif method == 'tort':
         # mean amplitude distribution along phase bins
         n_bins = N_BINS_TORT
+        amplitude_sum = np.zeros(n_bins)
+        count = np.zeros(n_bins)
+        for dst, src in circular_slices(amplitude.size, shift):
+            amplitude_sum += np.bincount(phase_preprocessed[src],
+                                         weights=amplitude[dst],
+                                         minlength=n_bins)
+            count += np.bincount(phase_preprocessed[src], minlength=n_bins)
         amplitude_dist = np.ones(n_bins)  # default is 1 to avoid log(0)
-        for b in np.unique(phase_preprocessed):
-            selection = amplitude[phase_preprocessed == b]
-            amplitude_dist[b] = np.mean(selection)
+        amplitude_dist[count > 0] = (amplitude_sum[count > 0] /
+                                     count[count > 0])
 
         # Kullback-Leibler divergence of the distribution vs uniform
         amplitude_dist /= np.sum(amplitude_dist)
@@ -748,12 +759,12 @@ def _bicoherence(estimator, sig, mask):
         **estimator.coherence_params)
 
     model = Bicoherence(**coherence_params)
-    bicoh = model.fit(sigs=sig, method=estimator.method)
-
-    # remove the redundant part
+    # the redundant part, and the bins outside the frequency ranges, are
+    # not computed and are set to zero
+    bicoh = model.fit(sigs=sig, method=estimator.method,
+                      high_fq_range=estimator.high_fq_range,
+                      low_fq_range=estimator.low_fq_range)
     n_freq = bicoh.shape[0]
-    np.flipud(bicoh)[np.triu_indices(n_freq, 1)] = 0
-    bicoh[np.triu_indices(n_freq, 1)] = 0
 
     frequencies = np.linspace(0, estimator.fs / 2., n_freq)
     comod = _interpolate(frequencies, frequencies, bicoh,
@@ -816,45 +827,75 @@ def _coherence(estimator, low_sig, filtered_high, mask):
         estimator.fs, estimator.low_fq_width, estimator.method,
         **estimator.coherence_params)
 
-    delayed_func = delayed(_one_coherence_modulation_index)
+    # split the shifts in contiguous chunks, one per job, since the spectra
+    # of filtered_high are computed only once per chunk
+    shifts = estimator.shifts_
+    n_chunks = min(effective_n_jobs(estimator.n_jobs), len(shifts))
+    chunks = np.array_split(shifts, n_chunks)
+
+    delayed_func = delayed(_coherence_modulation_indices)
     generator = (delayed_func(
-        shift=sh, fs=estimator.fs, low_sig=low_sig,
+        shifts=chunk, fs=estimator.fs, low_sig=low_sig,
         filtered_high=filtered_high, method=estimator.method,
         low_fq_range=estimator.low_fq_range, coherence_params=coherence_params)
-        for sh in estimator.shifts_)
+        for chunk in chunks)
     if estimator.progress_bar:
-        generator = estimator.progress_bar(generator)
+        generator = _chunks_progress(estimator.progress_bar, generator,
+                                     chunks)
 
     comod_list = Parallel(n_jobs=estimator.n_jobs)(generator)
-    comod_list = np.array(comod_list)
+    comod_list = np.concatenate(comod_list)
 
     return comod_list
 
 
-def _one_coherence_modulation_index(fs, low_sig, filtered_high, method,
-                                    low_fq_range, coherence_params, shift):
+def _chunks_progress(progress_bar, generator, chunks):
+    """Yield from generator, advancing the progress bar by the length of
+    the corresponding chunk"""
+    for task, chunk in zip(generator, chunks):
+        yield task
+        progress_bar.update_with_increment_value(len(chunk))
+
+
+def _coherence_modulation_indices(fs, low_sig, filtered_high, method,
+                                  low_fq_range, coherence_params, shifts):
     """
-    Compute one modulation index.
+    Compute the modulation indices for several shifts.
     Used by PAC method in COHERENCE_PAC_METRICS.
     """
-    if shift != 0:
-        low_sig = np.roll(low_sig, shift)
+    model = Coherence(**coherence_params)
+    coherences = model.fit_shifts(low_sig[None, :, :], filtered_high,
+                                  shifts)[:, 0]
+
+    # the interpolation weights are computed only once for all shifts
+    weights = None
+    comod_list = []
+    for coherence in coherences:
+        comod, weights = _one_coherence_modulation_index(
+            fs, coherence, method, low_fq_range, coherence_params,
+            weights=weights)
+        comod_list.append(comod)
+    return np.array(comod_list)
+
+
+def _one_coherence_modulation_index(fs, coherence, method, low_fq_range,
+                                    coherence_params, weights=None):
+    """
+    Compute one modulation index, from the coherence.
+    Used by PAC method in COHERENCE_PAC_METRICS.
 
+    Returns the modulation index, and the interpolation weights, which can
+    be given in a next call with a coherence of the same shape.
+    """
     # the actual frequency resolution is computed here
     delta_freq = fs / coherence_params['fft_length']
 
-    model = Coherence(**coherence_params)
-    coherence = model.fit(low_sig[None, :, :], filtered_high)[0]
     n_high, n_freq = coherence.shape
     frequencies = np.linspace(0, fs / 2., n_freq)
 
     # Coherence as in [Colgin & al 2009]
     if method == 'colgin':
-        coherence = np.real(np.abs(coherence))
-
-        comod = _interpolate(
-            np.arange(n_high), frequencies, coherence,
-            np.arange(n_high), low_fq_range)
+        values = np.real(np.abs(coherence))
 
     # Phase slope index as in [Jiang & al 2015]
     elif method == 'jiang':
@@ -872,38 +913,85 @@ def _one_coherence_modulation_index(fs, low_sig, filtered_high, method,
         frequencies = frequencies[ker:-ker]
 
         # transform the phase slope index into an approximated delay
-        delay = phase_slope_index / (2. * np.pi * delta_freq)
-
-        comod = _interpolate(
-            np.arange(n_high), frequencies, delay,
-            np.arange(n_high), low_fq_range)
+        values = phase_slope_index / (2. * np.pi * delta_freq)
 
     else:
         raise ValueError('Unknown method %s' % (method, ))
 
-    return comod
+    if weights is None:
+        weights = _interpolation_weights(np.arange(n_high), frequencies,
+                                         np.arange(n_high), low_fq_range)
+    comod = _interpolate(np.arange(n_high), frequencies, values,
+                         np.arange(n_high), low_fq_range, weights=weights)
+    return comod, weights
 
 
-def _interpolate(x1, y1, z1, x2, y2):
+def _interpolate(x1, y1, z1, x2, y2, weights=None):
     """Helper to interpolate in 1d or 2d
 
     We interpolate to get the same shape than with other methods.
+    In 2d, the values outside the grid (x1, y1) are extrapolated with the
+    nearest value. In 1d, they are set to NaN.
+
+    weights can be precomputed with _interpolation_weights, to interpolate
+    several arrays z1 on the same grids.
+    """
+    if weights is None:
+        weights = _interpolation_weights(x1, y1, x2, y2)
+    weights_x, weights_y = weights
+
+    if weights_x is not None and weights_y is not None:
+        z2 = weights_y.dot(weights_x.dot(z1).T)
+    elif weights_y is not None:
+        z2 = weights_y.dot(np.ravel(z1))
+    else:
+        z2 = weights_x.dot(np.ravel(z1))
+
+    z2.shape = (y2.size, x2.size)
+    return z2
+
+
+def _interpolation_weights(x1, y1, x2, y2):
+    """Precompute the sparse weights used in _interpolate
+
+    Returns
+    -------
+    weights_x, weights_y : sparse matrices or None
+        Linear interpolation weights from x1 to x2, and from y1 to y2.
+        They are None when the corresponding dimension is not interpolated.
     """
+    x1, y1, x2, y2 = [np.atleast_1d(a) for a in (x1, y1, x2, y2)]
     if x1.size > 1 and y1.size > 1:
-        func = interp2d(x1, y1, z1.T, kind='linear', bounds_error=False)
-        z2 = func(x2, y2)
+        return (_linear_weights(x1, x2, extrapolate=True),
+                _linear_weights(y1, y2, extrapolate=True))
     elif x1.size == 1 and y1.size > 1:
-        func = interp1d(y1, z1.ravel(), kind='linear', bounds_error=False)
-        z2 = func(y2)
+        return None, _linear_weights(y1, y2, extrapolate=False)
     elif y1.size == 1 and x1.size > 1:
-        func = interp1d(x1, z1.ravel(), kind='linear', bounds_error=False)
-        z2 = func(x2)
+        return _linear_weights(x1, x2, extrapolate=False), None
     else:
         raise ValueError("Can't interpolate a scalar.")
 
-    # interp2d is not intuitive and return this shape:
-    z2.shape = (y2.size, x2.size)
-    return z2
+
+def _linear_weights(x1, x2, extrapolate):
+    """Sparse matrix of linear interpolation weights, shape (n_x2, n_x1)
+
+    x1 must be increasing. Outside of [x1[0], x1[-1]], the nearest value is
+    used if extrapolate is True, and NaN otherwise.
+    """
+    n_x1, n_x2 = x1.size, x2.size
+    index = np.searchsorted(x1, x2, side='right') - 1
+    index = np.clip(index, 0, n_x1 - 2)
+    alpha = (x2 - x1[index]) / (x1[index + 1] - x1[index])
+    alpha = np.clip(alpha, 0., 1.)
+
+    data = np.concatenate([1. - alpha, alpha])
+    if not extrapolate:
+        outside = np.logical_or(x2 < x1[0], x2 > x1[-1])
+        data[np.concatenate([outside, outside])] = np.nan
+
+    rows = np.tile(np.arange(n_x2), 2)
+    cols = np.concatenate([index, index + 1])
+    return csr_matrix((data, (rows, cols)), shape=(n_x2, n_x1))
 
 
 def _driven_comodulogram(estimator, low_sig, high_sig, mask):
@@ -981,30 +1069,46 @@ def _driven_comodulogram_column(estimator, filtered_signals, high_sig, mask,
 
     sigin /= np.std(sigin)
 
-    results = []
+    # -------- fit one model per mask and per shift
+    # (the shifted drivers are all written in the same array)
+    sigdriv_shifted = np.empty(sigdriv.shape)
+    AR_list, G_list = [], []
     for i_mask, this_mask in enumerate(mask):
-        comod_list = []
         for sh in estimator.shifts_:
-            comod = _one_driven_modulation_index(
+            AR_cols, G_cols = _one_driven_model(
                 shift=sh, fs=estimator.fs, sigin=sigin, sigdriv=sigdriv,
                 sigdriv_imag=sigdriv_imag, model=model, mask=this_mask,
                 high_fq_range=estimator.high_fq_range,
-                ax_special=estimator.ax_special)
-            comod_list.append(comod)
-        results.append(np.array(comod_list))
+                ax_special=estimator.ax_special, out=sigdriv_shifted)
+            AR_list.append(AR_cols)
+            G_list.append(G_cols)
 
-    return results
+    # -------- evaluate all the spectra in a single vectorized pass
+    # (the AR models are padded with zeros if their orders are different)
+    n_rows = max(AR_cols.shape[0] for AR_cols in AR_list)
+    AR_all = np.zeros((len(AR_list), n_rows, AR_list[0].shape[1]))
+    for AR_cols, this_AR in zip(AR_list, AR_all):
+        this_AR[:AR_cols.shape[0]] = AR_cols
+    spec = ar_spectrum(AR_all, np.array(G_list), estimator.high_fq_range,
+                       estimator.fs)
 
+    comod = _driven_modulation_index(spec)
+    comod.shape = (len(mask), len(estimator.shifts_), -1)
 
-def _one_driven_modulation_index(fs, sigin, sigdriv, sigdriv_imag, model, mask,
-                                 high_fq_range, ax_special, shift):
+    return list(comod)
+
+
+def _one_driven_model(fs, sigin, sigdriv, sigdriv_imag, model, mask,
+                      high_fq_range, ax_special, shift, out=None):
     """
-    Compute one modulation index.
+    Fit one driven model, and develop it over the range of the driver.
     Used by PAC method in DAR_BASED_PAC_METRICS.
+
+    If not None, out is a preallocated array for the shifted driver.
     """
     # shift for the surrogate analysis
     if shift != 0:
-        sigdriv = np.roll(sigdriv, shift)
+        sigdriv = roll(sigdriv, shift, out=out)
 
     train_weights = ~mask if mask is not None else None
 
@@ -1012,29 +1116,25 @@ def _one_driven_modulation_index(fs, sigin, sigdriv, sigdriv_imag, model, mask,
     model.fit(fs=fs, sigin=sigin, sigdriv=sigdriv, sigdriv_imag=sigdriv_imag,
               train_weights=train_weights)
 
-    # estimate the length of the padding for the FFT
-    if len(high_fq_range) > 1:
-        delta_f = np.diff(high_fq_range).mean()
-        n_fft = next_power2(fs / delta_f)
-    else:
-        n_fft = 1024
-    # get PSD difference
-    spec, _, _, _ = model._amplitude_frequency(n_fft=n_fft)
+    if ax_special is not None and shift == 0:
+        model.plot(frange=[high_fq_range[0], high_fq_range[-1]], ax=ax_special)
 
-    # KL divergence for each phase, as in [Tort & al 2010]
-    n_freq, n_phases = spec.shape
-    spec = 10. ** (spec / 20.)
-    spec = spec / np.sum(spec, axis=1)[:, None]
-    spec_diff = np.sum(spec * np.log(spec * n_phases), axis=1)
-    spec_diff /= np.log(n_phases)
+    return model._amplitude_columns()
 
-    # crop the spectrum to high_fq_range
-    frequencies = np.linspace(0, fs // 2, spec_diff.size)
-    spec_diff = np.interp(high_fq_range, frequencies, spec_diff)
 
-    if ax_special is not None and shift == 0:
-        model.plot(frange=[high_fq_range[0], high_fq_range[-1]], ax=ax_special)
+def _driven_modulation_index(spec):
+    """
+    Compute the modulation index from the spectra of driven models.
+    Used by PAC method in DAR_BASED_PAC_METRICS.
 
+    spec : array, shape (..., n_freq, n_phases), power spectral density in dB
+    """
+    # KL divergence for each phase, as in [Tort & al 2010]
+    n_phases = spec.shape[-1]
+    spec = 10. ** (spec / 20.)
+    spec /= np.sum(spec, axis=-1)[..., None]
+    spec_diff = np.sum(spec * np.log(spec * n_phases), axis=-1)
+    spec_diff /= np.log(n_phases)
     return spec_diff
 
 
@@ -1,6 +1,7 @@
 from .stable_dar import StableDAR
 from .dar import DAR, AR
 from .har import HAR
+from .streaming import StreamingWhitener
 
 from .preprocess import extract_driver
 
@@ -9,5 +10,6 @@ __all__ = [
     'HAR',
     'AR',
     'StableDAR',
+    'StreamingWhitener',
     'extract_driver',
 ]
@@ -7,6 +7,7 @@ from scipy import linalg
 from scipy.signal import fftconvolve
 from scipy import stats
 
+from ..utils.parallel import Parallel, delayed
 from ..utils.progress_bar import ProgressBar
 from ..utils.maths import squared_norm
 # from ..utils.deprecation import ignore_warnings
@@ -24,7 +25,9 @@ class BaseDAR(object):
     def __init__(self, ordar=1, ordriv=0, criterion=None, normalize=True,
                  ortho=True, center=True, iter_gain=10, eps_gain=1.0e-4,
                  progress_bar=False, use_driver_phase=False, max_ordar=None,
-                 warn_gain_estimation_failure=False):
+                 warn_gain_estimation_failure=False,
+                 n_points_gain_init=None, warm_start=False,
+                 cache_basis=False, n_jobs=1):
         # -------- save parameters
         self.ordar = ordar
         self.criterion = criterion
@@ -36,6 +39,10 @@ class BaseDAR(object):
         self.progress_bar = progress_bar
         self.use_driver_phase = use_driver_phase
         self.warn_gain_estimation_failure = warn_gain_estimation_failure
+        self.n_points_gain_init = n_points_gain_init
+        self.warm_start = warm_start
+        self.cache_basis = cache_basis
+        self.n_jobs = n_jobs
 
         # for fair loglikelihood comparison
         self.max_ordar = max_ordar if max_ordar is not None else ordar
@@ -74,10 +81,12 @@ class BaseDAR(object):
                 mask = np.logical_and(train_weights == 0, test_weights == 0)
 
             # we remove far masked data (by both masks)
+            self.data_selection_ = self._compute_selection(mask)
             train_weights, test_weights, sigin, sigdriv, sigdriv_imag = \
                 self._remove_far_masked_data(
                     mask, [train_weights, test_weights, sigin,
-                           sigdriv, sigdriv_imag])
+                           sigdriv, sigdriv_imag],
+                    selection=self.data_selection_)
 
             self.train_mask_ = train_weights == 0
             if test_weights is not None:
@@ -87,9 +96,15 @@ class BaseDAR(object):
 
             check_consistent_shape(sigdriv, train_weights)
         else:
+            self.data_selection_ = None
             self.train_mask_ = None
             self.test_mask_ = None
 
+        # compute the selections once, since they are used at each access
+        # to the training or testing data
+        self.train_selection_ = self._compute_selection(self.train_mask_)
+        self.test_selection_ = self._compute_selection(self.test_mask_)
+
         if self.use_driver_phase and self.ordriv > 0:
             if sigdriv_imag is None:
                 raise ValueError('Impossible to use use_driver_phase=True '
@@ -99,7 +114,8 @@ class BaseDAR(object):
             sigdriv_imag = sigdriv_imag / amplitude
 
         if self.center:
-            sigin -= np.mean(sigin)
+            # not inplace, since sigin can be a view on the input signal
+            sigin = sigin - np.mean(sigin)
 
         # -------- save signals as attributes of the model
         self.sigin = sigin
@@ -141,32 +157,154 @@ class BaseDAR(object):
         self._check_all_arrays(sigin, sigdriv, sigdriv_imag, train_weights,
                                test_weights)
         self.fs = fs
+        self._fit_model()
+
+        return self
+
+    def fit_multichannel(self, sigin, sigdriv, fs, sigdriv_imag=None,
+                         train_weights=None, test_weights=None):
+        """Estimate one model per channel, with a driver shared by all channels
+
+        The basis and the masked data selection only depend on the driver and
+        on the weights, so they are computed once for all channels.
+
+        Parameters
+        ----------
+        sigin : array, shape (n_channels, n_epochs, n_points)
+            Signals that are to be modeled, one per channel
+
+        sigdriv : array, shape (n_epochs, n_points)
+            Signal that drives the models
+
+        fs : float > 0
+            Sampling frequency
+
+        sigdriv_imag : None or array, shape (n_epochs, n_points)
+            Second driver, containing the imaginary part of the driver
+
+        train_weights : None or array, shape (n_epochs, n_points)
+            If not None, the models are fitted with these sample weights.
+
+        test_weights : None or array, shape (n_epochs, n_points)
+            If not None, the models are tested with these sample weights.
+            If 'test_weights' is None, it is set equal to 'train_weights'.
+
+        Returns
+        -------
+        self
+
+        Attributes
+        ----------
+        AR_multichannel_ : array, shape (n_channels, ordar, n_basis)
+            AR coefficients of each channel. If the orders are selected with
+            a criterion, the coefficients are padded with zeros.
+
+        G_multichannel_ : array, shape (n_channels, 1, n_basis)
+            Gain coefficients of each channel, padded with zeros.
+
+        ordriv_multichannel_ : array, shape (n_channels, )
+            Order of the Taylor expansion of each channel.
+
+        criterions_multichannel_ : dict of arrays, shape (n_channels, )
+            Criterions (logl, aic, bic, ...) of each channel.
+
+        The fitted attributes of the model (AR_, G_, residual_, ...)
+        correspond to the last channel.
+        """
+        sigin = np.asarray(sigin, dtype='float64')
+        if sigin.ndim == 2:
+            sigin = sigin[:, None, :]
+        if sigin.ndim != 3:
+            raise ValueError('sigin should be 3 dimensional, got shape %s'
+                             % (sigin.shape, ))
+        n_channels = sigin.shape[0]
+        check_consistent_shape(sigin[0], check_array(sigdriv))
+
+        # -------- check the driver and the weights only once
+        self._check_all_arrays(sigin[0], sigdriv, sigdriv_imag, train_weights,
+                               test_weights)
+        self.fs = fs
+
+        # -------- compute the basis only once
+        # (it is cropped after an order selection, so we keep a reference)
+        self._make_basis()
+        basis, alpha = self.basis_, self.alpha_
+
+        AR_list, G_list, ordriv_list, criterions_list = [], [], [], []
+        for this_sigin in sigin:
+            self._reset_criterions()
+            self.sigin = self._check_sigin(this_sigin)
+            self.basis_, self.alpha_ = basis, alpha
+            self._fit_model(make_basis=False)
+
+            AR_list.append(self.AR_)
+            G_list.append(self.G_)
+            ordriv_list.append(self.ordriv_)
+            criterions_list.append(self._compute_criterion())
+
+        # -------- stack the models, padded with zeros
+        ordar = max(AR_.shape[0] for AR_ in AR_list)
+        n_basis = basis.shape[0]
+        self.AR_multichannel_ = np.zeros((n_channels, ordar, n_basis))
+        self.G_multichannel_ = np.zeros((n_channels, 1, n_basis))
+        for AR_, G_, AR_pad, G_pad in zip(AR_list, G_list,
+                                          self.AR_multichannel_,
+                                          self.G_multichannel_):
+            AR_pad[:AR_.shape[0], :AR_.shape[1]] = AR_
+            G_pad[:, :G_.shape[1]] = G_
+        self.ordriv_multichannel_ = np.array(ordriv_list)
+        self.criterions_multichannel_ = dict(
+            (key, np.array([criterions[key] for criterions in
+                            criterions_list]))
+            for key in criterions_list[0])
+
+        return self
 
+    def _check_sigin(self, sigin):
+        """Check a new sigin, with the driver and the weights already checked
+        and stored in the model"""
+        sigin = check_array(sigin)
+        sigin = self._remove_far_masked_data(
+            None, [sigin], selection=self.data_selection_)[0]
+        check_consistent_shape(sigin, self.sigdriv)
+
+        if self.center:
+            # not inplace, since sigin can be a view on the input signal
+            sigin = sigin - np.mean(sigin)
+        return sigin
+
+    def _fit_model(self, make_basis=True):
+        """Estimate the model from the signals stored in the model"""
         # -------- check parameters
         if self.ordar < 1:
             raise ValueError('self.ordar is zero or negative')
         if self.ordriv < 0:
             raise ValueError('self.ordriv is negative')
 
-        # -------- prepare the estimates
-        self.AR_ = np.ndarray(0)
-        self.G_ = np.ndarray(0)
+        self._reset_estimates()
 
         # -------- estimation of the model
         if self.criterion:
             # -------- select the best order
-            self._order_selection()
+            self._order_selection(make_basis=make_basis)
             self._estimate_error(recompute=True)
 
         else:
-            self._fit()
+            self._fit(make_basis=make_basis)
 
-        return self
+    def _reset_estimates(self):
+        """Prepare the estimates before a fit
+        (with warm_start, the previous estimates are used as initialization)
+        """
+        if not self.warm_start or not hasattr(self, 'AR_'):
+            self.AR_ = np.ndarray(0)
+            self.G_ = np.ndarray(0)
 
-    def _fit(self):
+    def _fit(self, make_basis=True):
         # -------- estimate a single model
         self.ordriv_ = self.ordriv
-        self._make_basis()
+        if make_basis:
+            self._make_basis()
         self._estimate_ar()
         self._estimate_error(recompute=self.test_weights is not None)
         self._estimate_gain()
@@ -202,6 +340,9 @@ class BaseDAR(object):
         the stored transform (self.alpha_) is applied on the new basis,
         and the method returns the new basis but does not store it.
 
+        If self.cache_basis is True, the last basis is kept in memory
+        (self.basis_cache_), and reused if the driver has not changed.
+
         Parameters
         ----------
         sigdriv : None or array, shape (n_epochs, n_points)
@@ -242,51 +383,127 @@ class BaseDAR(object):
             power_list_re, power_list_im, n_basis = self._compute_cross_orders(
                 ordriv)
 
-        # -------- memorize in alpha the various transforms
-        alpha = np.eye(n_basis)
-
-        # -------- create the basis
-        basis = np.zeros((n_basis, n_epochs * n_points))
+        # -------- the transformation applied on the raw basis
+        if save_basis:
+            alpha = None
+        elif self.normalize or self.ortho:
+            alpha = self.alpha_
+        else:
+            alpha = np.eye(n_basis)
+
+        # -------- reuse the basis if the driver has not changed
+        if self.cache_basis:
+            cached = self._get_cached_basis(sigdriv, sigdriv_imag, ordriv,
+                                            ortho, normalize, alpha)
+            if cached is not None:
+                basis, alpha = cached
+                if save_basis:
+                    self.basis_ = basis
+                    self.alpha_ = alpha
+                    return None
+                return basis
+
+        # -------- create the raw basis
+        basis = np.empty((n_basis, n_epochs * n_points))
+        sigdriv_ravel = sigdriv.ravel()
+        if sigdriv_imag is not None:
+            sigdriv_imag_ravel = sigdriv_imag.ravel()
 
-        # -------- create successive components
+        # each component is computed from a previous one, multiplying it by
+        # sigdriv (or sigdriv_imag), instead of computing the full power
+        index = {}
         for k, (power_real,
                 power_imag) in enumerate(zip(power_list_re, power_list_im)):
-            if power_imag == 0 and power_real == 0:
-                basis[k] = 1.0
-            elif power_imag > 0 and power_real == 0:
-                basis[k] = sigdriv_imag.ravel() ** power_imag
-            elif power_imag == 0 and power_real > 0:
-                basis[k] = sigdriv.ravel() ** power_real
-            elif power_imag > 0 and power_real > 0:
-                basis[k] = sigdriv_imag.ravel() ** power_imag
-                basis[k] *= sigdriv.ravel() ** power_real
-            else:
+            if power_imag < 0 or power_real < 0:
                 raise ValueError('Power cannot be negative : (%s, %s)' %
                                  (power_real, power_imag))
+            elif power_imag == 0 and power_real == 0:
+                basis[k] = 1.0
+            elif power_real > 0:
+                np.multiply(basis[index[(power_real - 1, power_imag)]],
+                            sigdriv_ravel, out=basis[k])
+            else:
+                np.multiply(basis[index[(power_real, power_imag - 1)]],
+                            sigdriv_imag_ravel, out=basis[k])
+            index[(power_real, power_imag)] = k
 
+        # -------- memorize in alpha the various transforms
+        # (basis = np.dot(alpha, rawbasis))
+        if alpha is None:
+            alpha = np.eye(n_basis)
             if ortho:
-                # correct current component with corrected components
-                for m in range(k):
-                    alpha[k, m] = -(np.sum(basis[k] * basis[m]) / np.sum(
-                        basis[m] * basis[m]))
-                basis[k] += np.dot(alpha[k, :k], basis[:k, :])
-                # recompute the expression over initial components
-                alpha[k, :k] = np.dot(alpha[k, :k], alpha[:k, :k])
-            if normalize:
-                scale = np.sqrt(
-                    float(n_epochs * n_points) / squared_norm(basis[k]))
-                basis[k] *= scale
-                alpha[k, :k + 1] *= scale
+                # Gram-Schmidt orthogonalisation, through a QR decomposition
+                # rawbasis.T = Q * R, and Q = rawbasis.T * inv(R)
+                # R is the Cholesky factor of the Gram matrix (fast), but
+                # its error grows with cond(gram) = cond(R) ** 2. As a cheap
+                # heuristic, we check the ratio of the diagonal of R. It is
+                # only a lower bound of cond(R), so it does not guarantee a
+                # small cond(gram), but it catches most ill-conditioned bases.
+                try:
+                    R = linalg.cholesky(np.dot(basis, basis.T), lower=False)
+                    diag = np.abs(np.diag(R))
+                    well_conditioned = diag.max() < 10. * diag.min()
+                except linalg.LinAlgError:
+                    well_conditioned = False
+                if not well_conditioned:
+                    # ill-conditioned basis, use a Householder QR (stable)
+                    R = np.linalg.qr(basis.T, mode='r')
+                diag = np.diag(R)
+                if normalize:
+                    scale = np.sqrt(float(n_epochs * n_points))
+                    diag = np.sign(diag) * scale
+                alpha = linalg.solve_triangular(R, np.diag(diag)).T
+            elif normalize:
+                scale = np.sqrt(float(n_epochs * n_points) /
+                                np.array([squared_norm(b) for b in basis]))
+                alpha.flat[::n_basis + 1] = scale
+
+        if self.normalize or self.ortho:
+            basis = np.dot(alpha, basis)
+        basis = basis.reshape(-1, n_epochs, n_points)
+
+        if self.cache_basis:
+            self.basis_cache_ = dict(
+                sigdriv=np.copy(sigdriv), ordriv=ordriv,
+                sigdriv_imag=(None if sigdriv_imag is None else
+                              np.copy(sigdriv_imag)),
+                ortho=ortho, normalize=normalize, save_basis=save_basis,
+                alpha=alpha, basis=basis)
 
         # -------- save basis and transformation matrix
-        # (basis = np.dot(alpha, rawbasis))
         if save_basis:
-            self.basis_ = basis.reshape(-1, n_epochs, n_points)
+            self.basis_ = basis.view()
             self.alpha_ = alpha
         else:
-            if self.normalize or self.ortho:
-                basis = np.dot(self.alpha_, basis)
-            return basis.reshape(-1, n_epochs, n_points)
+            return basis.view()
+
+    def _get_cached_basis(self, sigdriv, sigdriv_imag, ordriv, ortho,
+                          normalize, alpha):
+        """Returns the cached basis and transform if they correspond to the
+        given driver and parameters, otherwise returns None
+        """
+        cache = getattr(self, 'basis_cache_', None)
+        if cache is None or cache['ordriv'] != ordriv:
+            return None
+
+        # during the fit, the transform is estimated with ortho and normalize
+        if alpha is None:
+            if not (cache['save_basis'] and cache['ortho'] == ortho and
+                    cache['normalize'] == normalize):
+                return None
+        # during the transform, the transform is given
+        elif not np.array_equal(cache['alpha'], alpha):
+            return None
+
+        if not np.array_equal(cache['sigdriv'], sigdriv):
+            return None
+        if sigdriv_imag is None or cache['sigdriv_imag'] is None:
+            if sigdriv_imag is not cache['sigdriv_imag']:
+                return None
+        elif not np.array_equal(cache['sigdriv_imag'], sigdriv_imag):
+            return None
+
+        return cache['basis'].view(), cache['alpha']
 
     def _estimate_ar(self):
         """Estimates the AR model on a signal
@@ -305,12 +522,44 @@ class BaseDAR(object):
                     float(self.ordar_) / self.ordar, title=self.get_title(
                         name=True))
 
-    def _remove_far_masked_data(self, mask, list_signals):
+    def _remove_far_masked_data(self, mask, list_signals, selection=None):
         """Remove unnecessary data which is masked
         and far (> self.ordar) from the unmasked data.
+
+        If selection is not None, it is used instead of being computed from
+        the mask (see _compute_selection).
+        """
+        if selection is None:
+            if mask is None:
+                return list_signals
+            selection = self._compute_selection(mask)
+
+        epoch_selection, time_selection = selection
+        if not (isinstance(epoch_selection, slice) or
+                isinstance(time_selection, slice)):
+            epoch_selection, time_selection = np.ix_(epoch_selection,
+                                                     time_selection)
+        # with slices, this indexing does not copy the data
+        index = (Ellipsis, epoch_selection, time_selection)
+
+        output_signals = []
+        for sig in list_signals:
+            if sig is not None:
+                sig = sig[index]
+            output_signals.append(sig)
+
+        return output_signals
+
+    def _compute_selection(self, mask):
+        """Compute the selection of the data which is not masked, or masked
+        but close (<= self.ordar) to the unmasked data.
+
+        Returns None if mask is None, otherwise (epoch_selection,
+        time_selection), where each selection is a slice if it is contiguous,
+        and an array of indices otherwise.
         """
         if mask is None:
-            return list_signals
+            return None
 
         selection = ~mask
 
@@ -329,14 +578,8 @@ class BaseDAR(object):
         if not np.any(time_selection) or not np.any(epoch_selection):
             raise ValueError("The mask seems to hide everything.")
 
-        output_signals = []
-        for sig in list_signals:
-            if sig is not None:
-                sig = sig[..., epoch_selection, :]
-                sig = sig[..., :, time_selection]
-            output_signals.append(sig)
-
-        return output_signals
+        return (_selection_to_slice(epoch_selection),
+                _selection_to_slice(time_selection))
 
     def _get_train_data(self, sig_list):
         if not isinstance(sig_list, list):
@@ -344,7 +587,9 @@ class BaseDAR(object):
 
         train_weights = self.train_weights
         sig_list.append(train_weights)
-        sig_list = self._remove_far_masked_data(self.train_mask_, sig_list)
+        sig_list = self._remove_far_masked_data(
+            self.train_mask_, sig_list,
+            selection=self.train_selection_)
 
         return sig_list
 
@@ -356,7 +601,9 @@ class BaseDAR(object):
         if test_weights is None:
             test_weights = self.train_weights
         sig_list.append(test_weights)
-        sig_list = self._remove_far_masked_data(self.test_mask_, sig_list)
+        sig_list = self._remove_far_masked_data(
+            self.test_mask_, sig_list,
+            selection=self.test_selection_)
         return sig_list
 
     def degrees_of_freedom(self):
@@ -453,16 +700,19 @@ class BaseDAR(object):
         self.model_selection_criterions_ = None
         self.criterions_ = None
 
-    def _order_selection(self):
+    def _order_selection(self, make_basis=True):
         """Fit several models with a grid-search over self.ordar and
         self.ordriv, and select the model with the best criterion
         self.criterion (negative log_likelihood, AIC or BIC)
         """
         # compute the basis once and for all
-        self._make_basis()
+        if make_basis:
+            self._make_basis()
 
         criterion = self.criterion
         # -------- prepare the estimates
+        # (each model of the grid is estimated from scratch, even with
+        # warm_start, since the previous estimates have other orders)
         self.AR_ = np.ndarray(0)
         self.G_ = np.ndarray(0)
         ordar = self.ordar
@@ -481,39 +731,31 @@ class BaseDAR(object):
             criterion = '-logl'
 
         # -------- loop on ordriv with a copy of the estimator
-        if self.progress_bar:
+        bar = None
+        if self.progress_bar and self.n_jobs == 1:
             bar = ProgressBar(title='%s' % self.__class__.__name__,
                               max_value=logl.size)
-            bar_k = 0
-        for ordriv in range(ordriv + 1):
-            model = self.copy()
-            model.ordriv = ordriv
-            model.ordriv_ = ordriv
-            _, _, n_basis = model._compute_cross_orders(ordriv)
-            model.basis_ = self.basis_[:n_basis]
-
-            # -------- estimate the best AR order for this value of ordriv
-            for AR_ in model._next_model():
-                model.AR_ = AR_
-                if self.progress_bar:
-                    title = model.get_title(name=True)
-                    bar_k += 1
-                    bar.update(bar_k, title=title)
-
-                model._estimate_error(recompute=self.test_weights is not None)
-                model._estimate_gain()
-                model._reset_criterions()
-                this_criterion = model._compute_criterion()
-                logl[model.ordar_, model.ordriv_] = this_criterion['logl']
-                aic[model.ordar_, model.ordriv_] = this_criterion['aic']
-                bic[model.ordar_, model.ordriv_] = this_criterion['bic']
-
-                # -------- actualize the best model
-                if this_criterion[criterion] < best_criterion[criterion]:
-                    best_criterion = this_criterion
-                    self.AR_ = np.copy(model.AR_)
-                    self.G_ = np.copy(model.G_)
-                    self.ordriv_ = model.ordriv_
+        # the input signals are shared with the workers (through memory
+        # mapping) by joblib
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_order_selection_ordriv)(
+                self.copy(), ordriv=this_ordriv, basis=self.basis_,
+                criterion=criterion, bar=bar)
+            for this_ordriv in range(ordriv + 1))
+
+        # -------- gather the results, in the same order as the loop
+        for this_ordriv, result in enumerate(results):
+            this_logl, this_aic, this_bic, this_best, AR_, G_ = result
+            logl[:, this_ordriv] = this_logl
+            aic[:, this_ordriv] = this_aic
+            bic[:, this_ordriv] = this_bic
+
+            # -------- actualize the best model
+            if this_best[criterion] < best_criterion[criterion]:
+                best_criterion = this_best
+                self.AR_ = AR_
+                self.G_ = G_
+                self.ordriv_ = this_ordriv
 
         # store all criterions
         self.model_selection_criterions_ = \
@@ -557,6 +799,7 @@ class BaseDAR(object):
         # -------- estimate an initial (fixed) model of the residual
         self.G_ = np.zeros((1, self.n_basis))
         self.G_[0, 0] = np.log(sigma)
+        self.n_iter_gain_ = 0
 
     def _estimate_gain(self, regul=0.):
         """helper to handle failure in gain estimation"""
@@ -588,8 +831,6 @@ class BaseDAR(object):
         basis, residual, weights = self._get_train_data(
             [self.basis_, self.residual_])
 
-        residual += EPSILON
-
         # -------- crop the ordar first values
         residual = residual[:, ordar_:]
         basis = basis[:, :, ordar_:]
@@ -598,16 +839,63 @@ class BaseDAR(object):
 
         # concatenate the epochs since it does not change the computations
         # as in estimating the AR coefficients
-        residual = residual.reshape(1, -1)
+        # (do not add EPSILON inplace, since it would modify self.residual_)
+        residual = residual.reshape(1, -1) + EPSILON
         basis = basis.reshape(basis.shape[0], -1)
         if weights is not None:
             weights = weights.reshape(1, -1)
 
         residual2 = residual ** 2
         n_points = residual.size
-        self.G_ = np.zeros((1, self.n_basis))
 
         # -------- prepare an initial estimation
+        G_init = self.G_
+        if not (self.warm_start and G_init.shape == (1, self.n_basis)):
+            G_init = self._initial_gain(basis, residual2, weights,
+                                        regul=regul)
+        self.G_ = np.copy(G_init)
+
+        # -------- refine this model (iteratively maximise the likelihood)
+        # The gradient and the hessian only depend on the sufficient
+        # statistics (weighted) residual2 / sigma2 and (weighted) sum of the
+        # basis, and all the intermediate arrays are preallocated.
+        sigma2 = np.empty((1, n_points))
+        if iter_gain > 0:
+            if weights is not None:
+                residual2 = residual2 * weights
+                basis_sum = np.dot(basis, weights[0])
+            else:
+                basis_sum = np.sum(basis, axis=1)
+            ratio = np.empty((1, n_points))
+            scaled_basis = np.empty_like(basis)
+
+        for itnum in range(iter_gain):
+            self._compute_sigma2(basis, out=sigma2)
+            np.divide(residual2, sigma2, out=ratio)
+
+            gradient = np.dot(basis, ratio[0]) - basis_sum
+            np.multiply(basis, ratio, out=scaled_basis)
+            hessian = -2.0 * np.dot(scaled_basis, basis.T)
+
+            dG = linalg.solve(hessian, gradient)
+            self.G_ -= dG.T
+            if np.amax(np.absolute(dG)) < eps_gain:
+                iter_gain = itnum + 1
+                break
+
+        self.n_iter_gain_ = iter_gain
+        self._compute_sigma2(basis, out=sigma2)
+        self.residual_bis_ = residual / np.sqrt(sigma2)
+
+    def _initial_gain(self, basis, residual2, weights, regul=0.):
+        """Initial estimation of the gain, before the Newton-Raphson
+        procedure
+
+        basis     : array, shape (n_basis, n_points)
+        residual2 : array, shape (1, n_points), squared residual
+        weights   : None or array, shape (1, n_points)
+        regul     : regularization factor (for inversion of the Hessian)
+        """
         # chose N = 3 * ordriv_ classes, estimate a standard deviation
         # on each class, and make a regression on the values of
         # the indexes for their centroid.
@@ -615,32 +903,55 @@ class BaseDAR(object):
         # successive slices of the signal, but for signal driven
         # models, this would be wrong! Use levels of the driving
         # function instead.
-        if self.n_basis > 1:
-            index = np.argsort(basis[1, :])  # indexes to sort the basis
+        # The initial estimation can be done on a subsample of the points,
+        # keeping at least 10 points in each slice.
+        nbslices = 3 * self.n_basis  # number of slices
+        n_points = residual2.size
+        n_points_init = self.n_points_gain_init
+        if n_points_init is not None:
+            n_points_init = max(n_points_init, 10 * nbslices)
+        if n_points_init is not None and n_points > n_points_init:
+            step = int(np.ceil(n_points / float(n_points_init)))
         else:
-            index = np.arange(n_points, dtype=int)
+            step = 1
+        basis_init = basis[:, ::step]
+        residual2_init = residual2[0, ::step]
+        weights_init = weights[0, ::step] if weights is not None else None
+        n_points_init = residual2_init.size
 
-        nbslices = 3 * self.n_basis  # number of slices
-        lenslice = n_points // nbslices  # length of a slice
-        e = np.zeros(nbslices)  # log energies
+        lenslice = n_points_init // nbslices  # length of a slice
 
         # -------- prepare least-squares equations
         tmp = lenslice * np.arange(nbslices + 1)
         kmin = tmp[:-1]
         kmax = tmp[1:]
         kmid = (kmin + kmax) // 2
-        for k, (this_min, this_max) in enumerate(zip(kmin, kmax)):
-            indices = index[this_min:this_max]
-            if weights is not None:
-                e[k] = np.average(residual2[0, indices],
-                                  weights=weights[0, indices])
-            else:
-                e[k] = np.mean(residual2[0, indices])
+        if self.n_basis > 1:
+            # partial sort of the basis, only the slices' borders and
+            # centroids need to be at their sorted position
+            kth = np.unique(np.r_[kmin, kmax, kmid])
+            kth = kth[kth < n_points_init]
+            index = np.argpartition(basis_init[1, :], kth)
+        else:
+            index = np.arange(n_points_init, dtype=int)
+
+        # log energies on each slice
+        indices = index[:kmax[-1]].reshape(nbslices, lenslice)
+        if weights is not None:
+            weights_slices = weights_init[indices]
+            weights_sum = weights_slices.sum(axis=1)
+            if np.any(weights_sum == 0):
+                raise ZeroDivisionError(
+                    "Weights sum to zero, can't be normalized")
+            e = (np.sum(residual2_init[indices] * weights_slices, axis=1) /
+                 weights_sum)
+        else:
+            e = np.mean(residual2_init[indices], axis=1)
 
         # this least-square is not weighted, only the construction of e
         e = 0.5 * np.log(e)
-        R = np.dot(basis[:, index[kmid]], basis[:, index[kmid]].T)
-        r = np.dot(e, basis[:, index[kmid]].T)
+        R = np.dot(basis_init[:, index[kmid]], basis_init[:, index[kmid]].T)
+        r = np.dot(e, basis_init[:, index[kmid]].T)
 
         # -------- regularize matrix R
         v = np.resize(linalg.eigvalsh(R), (1, self.n_basis))
@@ -650,45 +961,17 @@ class BaseDAR(object):
         R.flat[::len(R) + 1] += correction
 
         # -------- compute regularized solution
-        self.G_ = linalg.solve(R, r)
-        self.G_.shape = (1, self.n_basis)
-
-        # -------- prepare the likelihood (and its initial value)
-        loglike = np.zeros(iter_gain + 1)
-        loglike.fill(np.nan)
-
-        if iter_gain > 0:
-            resreg = basis * residual
-            if weights is not None:
-                weighted_basis = weights * basis
-                weighted_resreg = weights * resreg
-        # -------- refine this model (iteratively maximise the likelihood)
-        for itnum in range(iter_gain):
-            sigma2 = self._compute_sigma2(basis)
-            loglike[itnum] = wgn_log_likelihood(residual, sigma2,
-                                                weights=weights)
-
-            tmp = residual2 / sigma2 - 1.0
-            if weights is not None:
-                gradient = np.sum(weighted_basis * tmp, 1)
-                hessian = -2.0 * np.dot(weighted_resreg / sigma2, resreg.T)
-            else:
-                gradient = np.sum(basis * tmp, 1)
-                hessian = -2.0 * np.dot(resreg / sigma2, resreg.T)
-            dG = linalg.solve(hessian, gradient)
-            self.G_ -= dG.T
-            if np.amax(np.absolute(dG)) < eps_gain:
-                iter_gain = itnum + 1
-                break
+        G_init = linalg.solve(R, r)
+        G_init.shape = (1, self.n_basis)
+        return G_init
 
-        sigma2 = self._compute_sigma2(basis)
-        self.residual_bis_ = residual / np.sqrt(sigma2)
-
-    def _compute_sigma2(self, basis):
+    def _compute_sigma2(self, basis, out=None):
         """Helper to compute the instantaneous variance of the model"""
         # with ignore_warnings():
-        logsigma = np.dot(self.G_, basis)
-        sigma2 = np.exp(2 * logsigma) + EPSILON
+        sigma2 = np.dot(self.G_, basis, out=out)
+        sigma2 *= 2
+        np.exp(sigma2, out=sigma2)
+        sigma2 += EPSILON
 
         if sigma2.max() > 1e5:
             raise RuntimeError(
@@ -862,9 +1145,12 @@ class BaseDAR(object):
     # ------------------------------------------------ #
     # Functions to plot the models                     #
     # ------------------------------------------------ #
-    def _basis2spec(self, sigdriv, sigdriv_imag=None, frange=None, n_fft=256):
+    def _basis2spec(self, sigdriv, sigdriv_imag=None, frange=None, n_fft=256,
+                    frequencies=None):
         """Compute the power spectral density for a given basis
         frange  : frequency range
+        frequencies : if not None, frequencies (in Hz) where the spectrum is
+                      directly evaluated, instead of the FFT grid of size n_fft
 
         this method is not intended for general use, except as a
         factorisation of the code of methods plot_time_freq and
@@ -873,10 +1159,16 @@ class BaseDAR(object):
         check_is_fitted(self, 'AR_')
         ordar_ = self.ordar_
 
-        AR_cols, G_cols, _, sigdriv = self._develop_all(sigdriv, sigdriv_imag)
-        # keep the only epoch
-        AR_cols = AR_cols[:, 0, :]
-        G_cols = G_cols[:1, :]
+        AR_cols, G_cols = self._develop_columns(sigdriv, sigdriv_imag)
+
+        # -------- evaluate the spectrum only at the given frequencies
+        if frequencies is not None:
+            frequencies = np.atleast_1d(frequencies)
+            if frange is not None:
+                mask = np.logical_and(frequencies <= frange[1],
+                                      frequencies >= frange[0])
+                frequencies = frequencies[mask]
+            return ar_spectrum(AR_cols, G_cols, frequencies, self.fs)
 
         # -------- estimate AR spectrum
         while n_fft < (ordar_ + 1):
@@ -900,14 +1192,40 @@ class BaseDAR(object):
             spec = spec[mask, :]
         return spec
 
+    def _develop_columns(self, sigdriv, sigdriv_imag=None):
+        """Compute the AR models and gains for a single epoch of sigdriv
+
+        returns:
+        AR_cols : array, shape (ordar_ + 1, n_columns)
+        G_cols  : array, shape (1, n_columns)
+        """
+        AR_cols, G_cols, _, _ = self._develop_all(sigdriv, sigdriv_imag)
+        # keep the only epoch
+        return AR_cols[:, 0, :], G_cols[:1, :]
+
+    def _amplitude_columns(self, nbcols=256, xlim=None):
+        """Compute the AR models and gains over the range of the driver
+
+        returns:
+        AR_cols : array, shape (ordar_ + 1, nbcols)
+        G_cols  : array, shape (1, nbcols)
+        """
+        check_is_fitted(self, 'AR_')
+        xlim, sigdriv, sigdriv_imag = self._driver_range(nbcols, xlim)
+        sigdriv = check_array(sigdriv)
+        sigdriv_imag = check_array(sigdriv_imag, accept_none=True)
+        return self._develop_columns(sigdriv, sigdriv_imag)
+
     def _amplitude_frequency(self, nbcols=256, frange=None, mode='', xlim=None,
-                             n_fft=256):
+                             n_fft=256, frequencies=None):
         """Computes an amplitude-frequency power spectral density
 
         nbcols : number of expected columns (amplitude)
         frange : frequency range
         mode   : normalisation mode ('c' = centered, 'v' = unit variance)
         xlim   : minimum and maximum amplitude
+        frequencies : if not None, frequencies (in Hz) where the spectrum is
+                      directly evaluated
 
         returns:
         spec : ndarray containing the time-frequency psd
@@ -921,7 +1239,8 @@ class BaseDAR(object):
 
         # -------- compute spectra
         spec = self._basis2spec(sigdriv=sigdriv, sigdriv_imag=sigdriv_imag,
-                                frange=frange, n_fft=n_fft)
+                                frange=frange, n_fft=n_fft,
+                                frequencies=frequencies)
 
         # -------- normalize
         if 'c' in mode:
@@ -938,7 +1257,7 @@ class BaseDAR(object):
 
         # full oscillation for derivative
         phase = np.linspace(-np.pi, np.pi, nbcols, endpoint=False)
-        if self.sigdriv_imag is None:
+        if not self._has_complex_driver():
             sigdriv = np.linspace(xlim[0], xlim[1], nbcols)
             sigdriv_imag = None
         else:
@@ -947,10 +1266,19 @@ class BaseDAR(object):
 
         return xlim, sigdriv, sigdriv_imag
 
+    def _has_complex_driver(self):
+        if self.sigdriv is None:
+            # the training data has been released
+            return self.complex_driver_
+        return self.sigdriv_imag is not None
+
     def _get_sigdriv_bounds(self, sigdriv=None, sigdriv_imag=None):
         if self.use_driver_phase:
             return [-1, 1]
 
+        if sigdriv is None and self.sigdriv is None:
+            # the training data has been released
+            return self.sigdriv_bounds_
         if sigdriv is None:
             sigdriv = self.sigdriv
         if sigdriv_imag is None:
@@ -1130,12 +1458,113 @@ class BaseDAR(object):
     def _to_dict(self):
         """Convert the model attributes to dict"""
 
-        data = self.__dict__
-        for k in data.keys():
-            if '__' in k or k[0] == '_':
-                del (data[k])
+        data = dict((k, v) for k, v in self.__dict__.items()
+                    if '__' not in k and k[0] != '_')
         return data
 
+    @classmethod
+    def _get_param_names(cls):
+        """Get the parameter names of __init__, in all the parent classes"""
+        names = []
+        for klass in cls.__mro__:
+            code = getattr(klass.__dict__.get('__init__'), '__code__', None)
+            if code is None:
+                continue
+            for name in code.co_varnames[1:code.co_argcount]:
+                if name not in names:
+                    names.append(name)
+        return sorted(names)
+
+    def release_training_data(self):
+        """Free the training signals and the large arrays kept after fit
+
+        The model keeps its parameters and its fitted coefficients, and can
+        still be used to compute and plot the spectra, or to whiten a new
+        signal with transform. The bounds of the training driver are stored
+        in self.sigdriv_bounds_ before the driver is released.
+
+        Returns
+        -------
+        self
+        """
+        check_is_fitted(self, 'AR_')
+        if self.sigdriv is not None:
+            self.sigdriv_bounds_ = self._get_sigdriv_bounds()
+            self.complex_driver_ = self.sigdriv_imag is not None
+
+        self.sigin = None
+        self.sigdriv = None
+        self.sigdriv_imag = None
+        self.basis_ = None
+        self.train_weights = None
+        self.test_weights = None
+        for name in ('residual_', 'residual_bis_', 'forward_residual',
+                     'backward_residual', 'basis_cache_', 'train_mask_',
+                     'test_mask_', 'spec_'):
+            if hasattr(self, name):
+                delattr(self, name)
+        return self
+
+    def to_state(self):
+        """Export the parameters and the fitted coefficients of the model
+
+        Contrary to the model itself, the state does not contain the
+        training signals, nor the basis and the residuals, so it is compact
+        and can be stored (e.g. with pickle). The model is recovered with
+        from_state.
+
+        Returns
+        -------
+        state : dict
+            Class name ('class'), parameters ('params') and fitted
+            attributes ('attributes') of the model
+        """
+        check_is_fitted(self, 'AR_')
+        params = dict((name, getattr(self, name))
+                      for name in self._get_param_names())
+
+        attributes = dict(
+            AR_=np.copy(self.AR_), G_=np.copy(self.G_),
+            alpha_=np.copy(self.alpha_), fs=self.fs, ordriv_=self.ordriv_,
+            n_basis=self.n_basis, criterions_=self.criterions_,
+            model_selection_criterions_=self.model_selection_criterions_)
+        if self.sigdriv is not None:
+            attributes['sigdriv_bounds_'] = self._get_sigdriv_bounds()
+            attributes['complex_driver_'] = self.sigdriv_imag is not None
+        else:
+            attributes['sigdriv_bounds_'] = self.sigdriv_bounds_
+            attributes['complex_driver_'] = self.complex_driver_
+
+        return {'class': self.__class__.__name__, 'params': params,
+                'attributes': attributes}
+
+    @classmethod
+    def from_state(cls, state):
+        """Create a fitted model from a state exported with to_state
+
+        The model has no training data, as after release_training_data.
+
+        Parameters
+        ----------
+        state : dict
+            State of the model, as returned by to_state
+
+        Returns
+        -------
+        model : instance of cls
+            The fitted model
+        """
+        if state['class'] != cls.__name__:
+            raise ValueError('Impossible to create a %s model from the state '
+                             'of a %s model.' % (cls.__name__, state['class']))
+        model = cls(**state['params'])
+        for name, value in state['attributes'].items():
+            setattr(model, name, value)
+        model.sigin = None
+        model.sigdriv = None
+        model.sigdriv_imag = None
+        return model
+
     def copy(self):
         """Creates a (deep) copy of a model"""
 
@@ -1161,6 +1590,66 @@ class BaseDAR(object):
         return self.get_title(name=True)
 
 
+def _order_selection_ordriv(model, ordriv, basis, criterion, bar=None):
+    """Fit the models with all the AR orders, for a given ordriv
+
+    Used in BaseDAR._order_selection, possibly in parallel.
+
+    Returns
+    -------
+    logl, aic, bic : arrays, shape (model.ordar + 1, )
+        Criterions of the models
+
+    best_criterion : dict
+        Criterions of the best model
+
+    AR_, G_ : arrays
+        Coefficients of the best model
+    """
+    model.ordriv = ordriv
+    model.ordriv_ = ordriv
+    _, _, n_basis = model._compute_cross_orders(ordriv)
+    model.basis_ = basis[:n_basis]
+
+    logl = np.zeros(model.ordar + 1)
+    aic = np.zeros(model.ordar + 1)
+    bic = np.zeros(model.ordar + 1)
+    best_criterion = {criterion: np.inf}
+    best_AR_, best_G_ = None, None
+
+    # -------- estimate the best AR order for this value of ordriv
+    for AR_ in model._next_model():
+        model.AR_ = AR_
+        if bar is not None:
+            bar.update_with_increment_value(
+                1, title=model.get_title(name=True))
+
+        model._estimate_error(recompute=model.test_weights is not None)
+        model._estimate_gain()
+        model._reset_criterions()
+        this_criterion = model._compute_criterion()
+        logl[model.ordar_] = this_criterion['logl']
+        aic[model.ordar_] = this_criterion['aic']
+        bic[model.ordar_] = this_criterion['bic']
+
+        # -------- actualize the best model
+        if this_criterion[criterion] < best_criterion[criterion]:
+            best_criterion = this_criterion
+            best_AR_ = np.copy(model.AR_)
+            best_G_ = np.copy(model.G_)
+
+    return logl, aic, bic, best_criterion, best_AR_, best_G_
+
+
+def _selection_to_slice(selection):
+    """Convert a boolean selection into a slice if it is contiguous, or into
+    an array of indices otherwise"""
+    indices = np.flatnonzero(selection)
+    if indices[-1] - indices[0] + 1 == indices.size:
+        return slice(indices[0], indices[-1] + 1)
+    return indices
+
+
 def wgn_log_likelihood(eps, sigma2, weights=None):
     """Returns the log-likelihood of a white Gaussian noise (WGN)
 
@@ -1197,3 +1686,38 @@ def wgn_log_likelihood(eps, sigma2, weights=None):
     logL *= -0.5
 
     return logL
+
+
+def ar_spectrum(AR_cols, G_cols, frequencies, fs):
+    """Returns the power spectral density (in dB) of driven AR models
+
+    The transfer function of each AR model is directly evaluated at the given
+    frequencies, which is faster than a zero-padded FFT when only a few
+    frequencies are needed.
+
+    Parameters
+    ----------
+    AR_cols : array, shape (..., ordar + 1, n_columns)
+        AR coefficients of each model, with the leading 1
+
+    G_cols : array, shape (..., 1, n_columns)
+        Gain of each model
+
+    frequencies : array, shape (n_frequencies, )
+        Frequencies (in Hz) where the spectrum is evaluated
+
+    fs : float
+        Sampling frequency
+
+    Returns
+    -------
+    spec : array, shape (..., n_frequencies, n_columns)
+        Power spectral density (in dB) of each model
+    """
+    frequencies = np.asarray(frequencies, dtype=float)
+    delays = np.arange(AR_cols.shape[-2])
+    fourier = np.exp(-2j * np.pi * np.outer(frequencies / fs, delays))
+    AR_spec = np.abs(np.matmul(fourier, AR_cols))
+
+    spec = 20.0 * (np.log10(G_cols) - np.log10(AR_spec))
+    return spec
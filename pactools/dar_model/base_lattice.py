@@ -4,21 +4,28 @@ import numpy as np
 from scipy import linalg
 
 from .base_dar import BaseDAR
+from .lattice_kernels import lattice_cell, lattice_whiten
+from .lattice_kernels import lattice_synthesize
 from ..utils.arma import ki2ai
 
 
 class BaseLattice(BaseDAR):
     __metaclass__ = ABCMeta
 
-    def __init__(self, iter_newton=0, eps_newton=0.001, **kwargs):
+    def __init__(self, iter_newton=0, eps_newton=0.001, low_memory=False,
+                 **kwargs):
         """Creates a base Lattice model with Taylor expansion
 
         iter_newton : maximum number of Newton-Raphson iterations
         eps_newton  : threshold to stop Newton-Raphson iterations
+        low_memory  : if True, only the residuals of the last two lattice
+                      cells are kept in memory during the fit, instead of
+                      the residuals of all the cells
         """
         super(BaseLattice, self).__init__(**kwargs)
         self.iter_newton = iter_newton
         self.eps_newton = eps_newton
+        self.low_memory = low_memory
 
     def synthesis(self, sigdriv=None, sigin_init=None):
         """Create a signal from fitted model
@@ -82,24 +89,15 @@ class BaseLattice(BaseDAR):
             basis = self.basis_
         else:
             basis = newbasis
-        # -------- select ordar (prefered: ordar_)
-        ordar = self.ordar_
 
         # -------- prepare excitation signal and burn in phase
         if burn_in is None:
             tburn = 0
             excitation = random_sig
         else:
-            tburn = burn_in.size
+            tburn = burn_in.shape[1]
             excitation = np.hstack((burn_in, random_sig))
 
-        n_basis, n_epochs, n_points = basis.shape
-        n_epochs, n_points_minus_ordar_ = random_sig.shape
-
-        # -------- allocate arrays for forward and backward residuals
-        e_forward = np.zeros(n_epochs, ordar + 1)
-        e_backward = np.zeros(n_epochs, ordar + 1)
-
         # -------- prepare parcor coefficients
         parcor_list = self._develop_parcor(self.AR_, basis)
         parcor_list = self.decode(parcor_list)
@@ -107,19 +105,7 @@ class BaseLattice(BaseDAR):
         gain = self._develop_gain(basis, squared=False, log=False)
 
         # -------- create the output signal
-        sigout = np.zeros(n_epochs, n_points_minus_ordar_)
-        for t in range(-tburn, n_points_minus_ordar_):
-            e_forward[:, ordar] = excitation[:, t + tburn] * gain[0, max(t, 0)]
-            for p in range(ordar, 0, -1):
-                e_forward[:, p - 1] = (
-                    e_forward[:, p] - parcor_list[p - 1, :, max(t, 0)] *
-                    e_backward[:, p - 1])
-            for p in range(ordar, 0, -1):
-                e_backward[:, p] = (
-                    e_backward[:, p - 1] + parcor_list[p - 1, :, max(t, 0)] *
-                    e_forward[:, p - 1])
-            e_backward[:, 0] = e_forward[:, 0]
-            sigout[:, max(t, 0)] = e_forward[:, 0]
+        sigout = lattice_synthesize(parcor_list, gain, excitation, tburn)
 
         return sigout
 
@@ -138,15 +124,7 @@ class BaseLattice(BaseDAR):
         backward_residual : backward residual after this cell
 
         """
-        f_residual = np.copy(forward_residual)
-        b_residual = np.zeros(backward_residual.shape)
-        delayed = np.copy(backward_residual[:, 0:-1])
-
-        # -------- apply the cell
-        b_residual[:, 1:] = delayed + (parcor_list[:, 1:] * f_residual[:, 1:])
-        b_residual[:, 0] = parcor_list[:, 0] * f_residual[:, 0]
-        f_residual[:, 1:] += parcor_list[:, 1:] * delayed
-        return f_residual, b_residual
+        return lattice_cell(parcor_list, forward_residual, backward_residual)
 
     def whiten(self):
         """Apply the direct lattice filter to whiten the original signal
@@ -160,16 +138,10 @@ class BaseLattice(BaseDAR):
         sigin = self.sigin
         basis = self.basis_
 
-        # -------- select ordar (prefered: ordar_)
-        ordar = self.ordar_
-        n_epochs, n_points = sigin.shape
-
-        residual = np.copy(sigin)
-        backward = np.copy(sigin)
-        for k in range(ordar):
-            parcor_list = self._develop_parcor(self.AR_[k], basis)
-            parcor_list = self.decode(parcor_list)
-            residual, backward = self.cell(parcor_list, residual, backward)
+        # -------- apply all the cells (ordar_ of them)
+        parcor_list = self._develop_parcor(self.AR_, basis)
+        parcor_list = self.decode(parcor_list)
+        residual, backward = lattice_whiten(parcor_list, sigin)
 
         return residual, backward
 
@@ -272,6 +244,12 @@ class BaseLattice(BaseDAR):
             raise ValueError('%s: basis_ does not yet exist' %
                              self.__class__.__name__)
 
+        # -------- previous model, used as initialization with warm_start
+        AR_init = self.AR_ if self.warm_start else None
+        if (self.iter_newton == 0 or AR_init is None or AR_init.ndim != 2 or
+                AR_init.shape[1] != self.n_basis):
+            AR_init = np.empty((0, self.n_basis))
+
         # --------  get the training data
         sigin, basis, weights = self._get_train_data([self.sigin, self.basis_])
 
@@ -290,58 +268,67 @@ class BaseLattice(BaseDAR):
         forward_res = np.copy(sigin)
         backward_res = np.copy(sigin)
 
-        self.forward_residual = np.empty((ordar_ + 1, n_epochs, n_points))
-        self.backward_residual = np.empty((ordar_ + 1, n_epochs, n_points))
+        # with low_memory, only the residuals of cells k and k - 1 are kept,
+        # and the cell k is stored at index k % 2 (see self._stage)
+        n_stages = 2 if self.low_memory else ordar_ + 1
+        self.forward_residual = np.empty((n_stages, n_epochs, n_points))
+        self.backward_residual = np.empty((n_stages, n_epochs, n_points))
         self.forward_residual[0] = forward_res
         self.backward_residual[0] = backward_res
 
+        self.n_iter_newton_ = np.zeros(ordar_, dtype=int)
+
         # -------- model at order 0
         AR_ = np.empty((0, self.n_basis))
         yield AR_
 
         # -------- loop on successive orders
         for k in range(0, ordar_):
-            # -------- prepare initial estimation (driven parcor)
-            if weights is not None:
-                # the weights and basis are not delay as backward_res /!\
-                forward_res = weights[:, k + 1:] * forward_res[:, k + 1:]
-                backward_res = weights[:, k + 1:] * backward_res[:, k:-1]
+            if k < AR_init.shape[0]:
+                # -------- start from the previous model (warm_start)
+                LAR = np.copy(AR_init[k:k + 1])
             else:
-                forward_res = forward_res[:, k + 1:]
-                backward_res = backward_res[:, k:-1]
-
-            forward_regressor = basis[:, :, k + 1:] * forward_res
-            backward_regressor = basis[:, :, k + 1:] * backward_res
-
-            # this reshape method will throw an error if a copy is needed
-            forward_regressor.shape = (n_basis, -1)
-            backward_regressor.shape = (n_basis, -1)
-            backward_res.shape = (1, -1)
-
-            R = (np.dot(forward_regressor, forward_regressor.T) + np.dot(
-                backward_regressor, backward_regressor.T))
-            r = np.dot(forward_regressor, backward_res.T)
-            backward_res.shape = (n_epochs, -1)
-
-            R *= scale
-            r *= scale * 2.0
-            parcor = -np.linalg.solve(R, r).T
-
-            # n_basis, n_epochs, n_points = basis.shape
-            # n_epochs, n_points = parcor_list.shape
-            parcor_list = self._develop_parcor(parcor.ravel(), basis)
-            parcor_list = np.maximum(parcor_list, -0.999999)
-            parcor_list = np.minimum(parcor_list, 0.999999)
-
-            lar_list = self.encode(parcor_list[:, k:])
-            if weights is not None:
-                lar_list *= weights[:, k:]
-
-            R2 = scale * np.dot(w_basis[:, :, k:].reshape(n_basis, -1),
-                                w_basis[:, :, k:].reshape(n_basis, -1).T)
-            r2 = scale * np.dot(w_basis[:, :, k:].reshape(n_basis, -1),
-                                lar_list.reshape(-1, 1))
-            LAR = np.linalg.solve(R2, r2).T
+                # -------- prepare initial estimation (driven parcor)
+                if weights is not None:
+                    # the weights and basis are not delay as backward_res /!\
+                    forward_res = weights[:, k + 1:] * forward_res[:, k + 1:]
+                    backward_res = weights[:, k + 1:] * backward_res[:, k:-1]
+                else:
+                    forward_res = forward_res[:, k + 1:]
+                    backward_res = backward_res[:, k:-1]
+
+                forward_regressor = basis[:, :, k + 1:] * forward_res
+                backward_regressor = basis[:, :, k + 1:] * backward_res
+
+                # this reshape method will throw an error if a copy is needed
+                forward_regressor.shape = (n_basis, -1)
+                backward_regressor.shape = (n_basis, -1)
+                backward_res.shape = (1, -1)
+
+                R = (np.dot(forward_regressor, forward_regressor.T) + np.dot(
+                    backward_regressor, backward_regressor.T))
+                r = np.dot(forward_regressor, backward_res.T)
+                backward_res.shape = (n_epochs, -1)
+
+                R *= scale
+                r *= scale * 2.0
+                parcor = -np.linalg.solve(R, r).T
+
+                # n_basis, n_epochs, n_points = basis.shape
+                # n_epochs, n_points = parcor_list.shape
+                parcor_list = self._develop_parcor(parcor.ravel(), basis)
+                parcor_list = np.maximum(parcor_list, -0.999999)
+                parcor_list = np.minimum(parcor_list, 0.999999)
+
+                lar_list = self.encode(parcor_list[:, k:])
+                if weights is not None:
+                    lar_list *= weights[:, k:]
+
+                R2 = scale * np.dot(w_basis[:, :, k:].reshape(n_basis, -1),
+                                    w_basis[:, :, k:].reshape(n_basis, -1).T)
+                r2 = scale * np.dot(w_basis[:, :, k:].reshape(n_basis, -1),
+                                    lar_list.reshape(-1, 1))
+                LAR = np.linalg.solve(R2, r2).T
 
             # -------- Newton-Raphson refinement
             dLAR = np.inf
@@ -354,10 +341,10 @@ class BaseLattice(BaseDAR):
                 lar_list = self._develop_parcor(LAR.ravel(), basis)
                 parcor_list = self.decode(lar_list)
                 forward_res_next, backward_res_next = self.cell(
-                    parcor_list, self.forward_residual[k],
-                    self.backward_residual[k])
-                self.forward_residual[k + 1] = forward_res_next
-                self.backward_residual[k + 1] = backward_res_next
+                    parcor_list, self.forward_residual[self._stage(k)],
+                    self.backward_residual[self._stage(k)])
+                self.forward_residual[self._stage(k + 1)] = forward_res_next
+                self.backward_residual[self._stage(k + 1)] = backward_res_next
 
                 # -------- correct the current vector
                 g = self._common_gradient(k + 1, parcor_list)
@@ -379,19 +366,27 @@ class BaseLattice(BaseDAR):
                     linalg.solve(hessian, gradient), (1, n_basis))
                 LAR -= dLAR
 
+            self.n_iter_newton_[k] = itnum
+
             # -------- save current cell and residuals
             lar_list = self._develop_parcor(LAR.ravel(), basis)
             parcor_list = self.decode(lar_list)
 
-            forward_res, backward_res = self.cell(parcor_list,
-                                                  self.forward_residual[k],
-                                                  self.backward_residual[k])
-            self.forward_residual[k + 1] = forward_res
-            self.backward_residual[k + 1] = backward_res
+            forward_res, backward_res = self.cell(
+                parcor_list, self.forward_residual[self._stage(k)],
+                self.backward_residual[self._stage(k)])
+            self.forward_residual[self._stage(k + 1)] = forward_res
+            self.backward_residual[self._stage(k + 1)] = backward_res
 
             AR_ = np.vstack((AR_, np.reshape(LAR, (1, n_basis))))
             yield AR_
 
+    def _stage(self, p):
+        """Index of the residuals of the lattice cell p, in
+        self.forward_residual and self.backward_residual
+        """
+        return p % self.forward_residual.shape[0]
+
     def _estimate_error(self, recompute=False):
         """Estimates the prediction error
 
@@ -401,7 +396,8 @@ class BaseLattice(BaseDAR):
         if not recompute:
             # if residual are stored, simply return the right one
             try:
-                self.residual_ = self.forward_residual[self.ordar_]
+                self.residual_ = self.forward_residual[self._stage(
+                    self.ordar_)]
             # otherwise, compute the prediction error
             except AttributeError:
                 recompute = True
@@ -424,11 +420,12 @@ class BaseLattice(BaseDAR):
         ordar = self.ordar_
 
         # -------- expand on the basis
-        AR_cols = np.ones((1, n_epochs, n_points))
+        AR_cols = np.empty((1 + ordar, n_epochs, n_points))
+        AR_cols[0] = 1.
         if ordar > 0:
             parcor_list = self._develop_parcor(self.AR_, basis)
             parcor_list = self.decode(parcor_list)
-            AR_cols = np.vstack((AR_cols, ki2ai(parcor_list)))
+            AR_cols[1:] = ki2ai(parcor_list)
         G_cols = self._develop_gain(basis, squared=False, log=False)
 
         return AR_cols, G_cols
@@ -1,6 +1,7 @@
 import numpy as np
 
 from .base_dar import BaseDAR
+from ..utils.maths import roll
 
 
 class DAR(BaseDAR):
@@ -51,8 +52,28 @@ class DAR(BaseDAR):
     eps_gain : float >= 0
         Threshold to stop iterations in gain estimation
 
+    n_points_gain_init : None or int > 0
+        If not None, the initial estimation of the gain uses a regular
+        subsample of (at most) this number of points. The subsample keeps
+        at least 30 * n_basis points, where n_basis is the number of
+        components of the basis built from the driver.
+
     use_driver_phase : boolean
         If True, we divide the driver by its instantaneous amplitude.
+
+    cache_basis : boolean
+        If True, the basis built from the driver is kept in memory, and
+        reused if the model is fitted again on the same driver.
+
+    n_jobs : int
+        Number of jobs to run in parallel in the order selection (when
+        criterion is not None), over the values of ordriv.
+
+    warm_start : boolean
+        If True, the gain estimated in the previous call to fit is used as
+        initialization of the gain estimation. It is ignored in the order
+        selection (when criterion is not None), where each model of the
+        grid is estimated from scratch.
     """
 
     def _last_model(self):
@@ -112,15 +133,106 @@ class DAR(BaseDAR):
                                sigreg.reshape(K * m, -1).T)
 
             # -------- loop on successive orders
-            range_iter = [K - 1, ] if only_last else range(K)
-            for k in range_iter:
-                km = k * m
-                km_m = km + m
+            for AR_ in self._solve_moments(R, r, only_last=only_last):
+                yield AR_
 
-                AR_ = -np.linalg.solve(R[0:km_m, 0:km_m], r[:1, 0:km_m].T)
+    def _solve_moments(self, R, r, only_last=False):
+        """Solve the regression at successive orders, given the moments
 
-                AR_ = np.reshape(AR_, (k + 1, m))
-                yield AR_
+        Acts as a generator that returns AR_, with orders from 1 to
+        self.ordar
+        """
+        m = self.n_basis
+        K = self.ordar
+        range_iter = [K - 1, ] if only_last else range(K)
+        for k in range_iter:
+            km_m = (k + 1) * m
+
+            AR_ = -np.linalg.solve(R[0:km_m, 0:km_m], r[:1, 0:km_m].T)
+
+            AR_ = np.reshape(AR_, (k + 1, m))
+            yield AR_
+
+    def _delayed_moments(self, shifts):
+        """Compute the regression moments for several delays of the basis
+
+        For each shift, the moments (R, r) are equal to those computed in
+        _estimate_model with the basis rolled by shift along time (e.g. with
+        a delayed driver). The products of the lagged signals do not depend
+        on the shift, so they are computed only once, and each moment is the
+        inner product of a rolled product of the basis with a fixed product
+        of the lagged signals.
+
+        uses self.sigin, self.basis_ and self.train_weights, which should
+        not be cropped in the training data
+
+        Parameters
+        ----------
+        shifts : array of int, shape (n_shifts, )
+            Shifts (in samples) applied to the basis
+
+        Returns
+        -------
+        R : array, shape (n_shifts, ordar * n_basis, ordar * n_basis)
+            Auto-correlations of the regression signals
+
+        r : array, shape (n_shifts, 1, ordar * n_basis)
+            Inter-correlations of the regression signals with sigin
+        """
+        sigin, basis, weights = self._get_train_data([self.sigin,
+                                                      self.basis_])
+        n_epochs, n_points = sigin.shape
+        m = self.n_basis
+        K = self.ordar
+
+        # -------- products of the lagged signals, as in _estimate_model
+        # (only the upper triangles, since the moments are symmetric)
+        lagged = np.zeros((K, n_epochs, n_points))
+        for k in range(K):
+            lagged[k, :, K:] = sigin[:, K - 1 - k:n_points - 1 - k]
+        w_lagged = lagged * weights if weights is not None else lagged
+        k_0, k_1 = np.triu_indices(K)
+        lagged_products = (w_lagged[k_0] * lagged[k_1]).reshape(k_0.size, -1)
+        inter_products = (w_lagged * sigin).reshape(K, -1)
+        del lagged, w_lagged
+
+        b_0, b_1 = np.triu_indices(m)
+        basis_products = basis[b_0] * basis[b_1]
+        k_0, k_1 = k_0[None, :], k_1[None, :]
+        b_0, b_1 = b_0[:, None], b_1[:, None]
+
+        scale = 1.0 / n_points
+        R = np.empty((len(shifts), K, m, K, m))
+        r = np.empty((len(shifts), K, m))
+        rolled_products = np.empty(basis_products.shape)
+        rolled_basis = np.empty(basis.shape)
+        for i_shift, shift in enumerate(shifts):
+            rolled = roll(basis_products, shift, axis=-1, out=rolled_products)
+            corr = scale * np.dot(rolled.reshape(b_0.size, -1),
+                                  lagged_products.T)
+            R[i_shift, k_0, b_0, k_1, b_1] = corr
+            R[i_shift, k_1, b_0, k_0, b_1] = corr
+            R[i_shift, k_0, b_1, k_1, b_0] = corr
+            R[i_shift, k_1, b_1, k_0, b_0] = corr
+
+            rolled = roll(basis, shift, axis=-1, out=rolled_basis)
+            r[i_shift] = scale * np.dot(inter_products,
+                                        rolled.reshape(m, -1).T)
+
+        R = R.reshape(len(shifts), K * m, K * m)
+        r = r.reshape(len(shifts), 1, K * m)
+        return R, r
+
+    def _fit_from_moments(self, R, r):
+        """Estimate a single model, with the regression moments computed
+        beforehand (e.g. with _delayed_moments), and self.basis_ already set
+        """
+        self._reset_estimates()
+        self.ordriv_ = self.ordriv
+        for AR_ in self._solve_moments(R, r, only_last=True):
+            self.AR_ = AR_
+        self._estimate_error(recompute=self.test_weights is not None)
+        self._estimate_gain()
 
     def _estimate_error(self, recompute=False):
         """Estimates the prediction error
@@ -41,8 +41,28 @@ class HAR(BaseDAR):
     eps_gain : float >= 0
         Threshold to stop iterations in gain estimation
 
+    n_points_gain_init : None or int > 0
+        If not None, the initial estimation of the gain uses a regular
+        subsample of (at most) this number of points. The subsample keeps
+        at least 30 * n_basis points, where n_basis is the number of
+        components of the basis built from the driver.
+
     use_driver_phase : boolean
         If True, we divide the driver by its instantaneous amplitude.
+
+    cache_basis : boolean
+        If True, the basis built from the driver is kept in memory, and
+        reused if the model is fitted again on the same driver.
+
+    n_jobs : int
+        Number of jobs to run in parallel in the order selection (when
+        criterion is not None), over the values of ordriv.
+
+    warm_start : boolean
+        If True, the gain estimated in the previous call to fit is used as
+        initialization of the gain estimation. It is ignored in the order
+        selection (when criterion is not None), where each model of the
+        grid is estimated from scratch.
     """
 
     def _last_model(self):
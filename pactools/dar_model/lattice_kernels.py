@@ -0,0 +1,220 @@
+"""Forward and backward recursions of the lattice filter.
+
+Each recursion has two implementations: a loop kernel, compiled with numba
+when it is installed (optional dependency), and a NumPy implementation used
+as a fallback. Both give the same results.
+
+In the NumPy fallback, a lattice cell is vectorized over epochs and time, so
+the whitening only loops over the cells (the order). The synthesis is
+recursive in time, so it is only vectorized over epochs, and loops over time
+and order in Python: it is much faster with numba.
+"""
+import numpy as np
+
+from ..utils.jit import njit, HAS_NUMBA
+
+
+def lattice_cell(parcor_list, forward_residual, backward_residual):
+    """Apply a single cell of the direct lattice filter
+
+    Parameters
+    ----------
+    parcor_list : array, shape (n_epochs, n_points)
+        Lattice coefficients of the cell
+
+    forward_residual : array, shape (n_epochs, n_points)
+        Forward residual from previous cell
+
+    backward_residual : array, shape (n_epochs, n_points)
+        Backward residual from previous cell
+
+    Returns
+    -------
+    f_residual : array, shape (n_epochs, n_points)
+        Forward residual after this cell
+
+    b_residual : array, shape (n_epochs, n_points)
+        Backward residual after this cell
+    """
+    if HAS_NUMBA:
+        f_residual = np.empty(forward_residual.shape)
+        b_residual = np.empty(backward_residual.shape)
+        _cell_loop(parcor_list, forward_residual, backward_residual,
+                   f_residual, b_residual)
+        return f_residual, b_residual
+    return _cell_numpy(parcor_list, forward_residual, backward_residual)
+
+
+def lattice_whiten(parcor_list, sigin, delayed=None):
+    """Apply the direct lattice filter on all successive cells
+
+    Parameters
+    ----------
+    parcor_list : array, shape (ordar, n_epochs, n_points)
+        Lattice coefficients of each cell
+
+    sigin : array, shape (n_epochs, n_points)
+        Signal to whiten
+
+    delayed : None or array, shape (ordar, n_epochs)
+        Backward residual entering each cell, at the sample preceding sigin.
+        It is updated inplace with the values at the last sample of sigin,
+        to whiten a following block of signal. If None, it is zero.
+
+    Returns
+    -------
+    residual : array, shape (n_epochs, n_points)
+        Forward residual (whitened signal) after the last cell
+
+    backward : array, shape (n_epochs, n_points)
+        Backward residual after the last cell
+    """
+    if delayed is None:
+        delayed = np.zeros((parcor_list.shape[0], sigin.shape[0]))
+
+    if HAS_NUMBA:
+        residual = np.empty(sigin.shape)
+        backward = np.empty(sigin.shape)
+        _whiten_loop(parcor_list, sigin, residual, backward, delayed)
+        return residual, backward
+
+    residual = np.copy(sigin)
+    backward = np.copy(sigin)
+    for k, parcor in enumerate(parcor_list):
+        last = np.copy(backward[:, -1])
+        residual, backward = _cell_numpy(parcor, residual, backward,
+                                         delayed[k])
+        delayed[k] = last
+    return residual, backward
+
+
+def lattice_synthesize(parcor_list, gain, excitation, tburn):
+    """Apply the inverse lattice filter to synthesize a signal
+
+    Parameters
+    ----------
+    parcor_list : array, shape (ordar, n_epochs, n_points)
+        Lattice coefficients of each cell
+
+    gain : array, shape (n_epochs, n_points)
+        Instantaneous gain applied on the excitation
+
+    excitation : array, shape (n_epochs, tburn + n_points_out)
+        Excitation signal, starting with tburn samples of burn in
+
+    tburn : int
+        Number of samples of burn in, using the coefficients at t=0
+
+    Returns
+    -------
+    sigout : array, shape (n_epochs, n_points_out)
+        Synthesized signal
+    """
+    ordar = parcor_list.shape[0]
+    n_epochs, n_excitation = excitation.shape
+    sigout = np.zeros((n_epochs, n_excitation - tburn))
+    if HAS_NUMBA:
+        _synthesize_loop(parcor_list, gain, excitation, tburn, sigout)
+        return sigout
+
+    # -------- allocate arrays for forward and backward residuals
+    e_forward = np.zeros((n_epochs, ordar + 1))
+    e_backward = np.zeros((n_epochs, ordar + 1))
+
+    for t in range(-tburn, n_excitation - tburn):
+        t_coef = max(t, 0)
+        e_forward[:, ordar] = excitation[:, t + tburn] * gain[:, t_coef]
+        for p in range(ordar, 0, -1):
+            parcor = parcor_list[p - 1, :, t_coef]
+            e_forward[:, p - 1] = (e_forward[:, p] -
+                                   parcor * e_backward[:, p - 1])
+        for p in range(ordar, 0, -1):
+            parcor = parcor_list[p - 1, :, t_coef]
+            e_backward[:, p] = (e_backward[:, p - 1] +
+                                parcor * e_forward[:, p - 1])
+        e_backward[:, 0] = e_forward[:, 0]
+        sigout[:, t_coef] = e_forward[:, 0]
+
+    return sigout
+
+
+def _cell_numpy(parcor_list, forward_residual, backward_residual,
+                initial_delayed=None):
+    """NumPy implementation of lattice_cell
+
+    initial_delayed is the backward residual at the sample preceding the
+    signal, with shape (n_epochs, ). If None, it is zero.
+    """
+    f_residual = np.copy(forward_residual)
+    b_residual = np.zeros(backward_residual.shape)
+    delayed = np.copy(backward_residual[:, 0:-1])
+
+    # -------- apply the cell
+    b_residual[:, 1:] = delayed + (parcor_list[:, 1:] * f_residual[:, 1:])
+    b_residual[:, 0] = parcor_list[:, 0] * f_residual[:, 0]
+    f_residual[:, 1:] += parcor_list[:, 1:] * delayed
+    if initial_delayed is not None:
+        b_residual[:, 0] += initial_delayed
+        f_residual[:, 0] += parcor_list[:, 0] * initial_delayed
+    return f_residual, b_residual
+
+
+@njit(cache=True)
+def _cell_loop(parcor_list, forward_residual, backward_residual, f_residual,
+               b_residual):
+    """Loop kernel of lattice_cell, filling f_residual and b_residual"""
+    n_epochs, n_points = forward_residual.shape
+    for i in range(n_epochs):
+        delayed = 0.
+        for t in range(n_points):
+            k = parcor_list[i, t]
+            f = forward_residual[i, t]
+            f_residual[i, t] = f + k * delayed
+            b_residual[i, t] = delayed + k * f
+            delayed = backward_residual[i, t]
+
+
+@njit(cache=True)
+def _whiten_loop(parcor_list, sigin, residual, backward, delayed):
+    """Loop kernel of lattice_whiten, filling residual and backward, and
+    updating delayed"""
+    ordar = parcor_list.shape[0]
+    n_epochs, n_points = sigin.shape
+    # delayed[k, i] is the backward residual entering cell k at the
+    # previous time
+    for i in range(n_epochs):
+        for t in range(n_points):
+            f = sigin[i, t]
+            b = sigin[i, t]
+            for k in range(ordar):
+                parcor = parcor_list[k, i, t]
+                f_next = f + parcor * delayed[k, i]
+                b_next = delayed[k, i] + parcor * f
+                delayed[k, i] = b
+                f = f_next
+                b = b_next
+            residual[i, t] = f
+            backward[i, t] = b
+
+
+@njit(cache=True)
+def _synthesize_loop(parcor_list, gain, excitation, tburn, sigout):
+    """Loop kernel of lattice_synthesize, filling sigout"""
+    ordar = parcor_list.shape[0]
+    n_epochs, n_excitation = excitation.shape
+    e_forward = np.zeros(ordar + 1)
+    e_backward = np.zeros(ordar + 1)
+    for i in range(n_epochs):
+        e_forward[:] = 0.
+        e_backward[:] = 0.
+        for t in range(-tburn, n_excitation - tburn):
+            t_coef = max(t, 0)
+            e_forward[ordar] = excitation[i, t + tburn] * gain[i, t_coef]
+            for p in range(ordar, 0, -1):
+                parcor = parcor_list[p - 1, i, t_coef]
+                e_forward[p - 1] = e_forward[p] - parcor * e_backward[p - 1]
+            for p in range(ordar, 0, -1):
+                parcor = parcor_list[p - 1, i, t_coef]
+                e_backward[p] = e_backward[p - 1] + parcor * e_forward[p - 1]
+            e_backward[0] = e_forward[0]
+            sigout[i, t_coef] = e_forward[0]
@@ -57,8 +57,40 @@ class StableDAR(BaseLattice):
     eps_gain : float >= 0
         Threshold to stop iterations in gain estimation
 
+    n_points_gain_init : None or int > 0
+        If not None, the initial estimation of the gain uses a regular
+        subsample of (at most) this number of points. The subsample keeps
+        at least 30 * n_basis points, where n_basis is the number of
+        components of the basis built from the driver.
+
     use_driver_phase : boolean
         If True, we divide the driver by its instantaneous amplitude.
+
+    iter_newton : int >= 0
+        Maximum number of Newton-Raphson iterations in LAR estimation
+
+    eps_newton : float >= 0
+        Threshold to stop Newton-Raphson iterations in LAR estimation
+
+    cache_basis : boolean
+        If True, the basis built from the driver is kept in memory, and
+        reused if the model is fitted again on the same driver.
+
+    low_memory : boolean
+        If True, only the residuals of the last two lattice cells are kept
+        in memory during the fit, instead of the residuals of all the cells.
+
+    n_jobs : int
+        Number of jobs to run in parallel in the order selection (when
+        criterion is not None), over the values of ordriv.
+
+    warm_start : boolean
+        If True, the gain estimated in the previous call to fit is used as
+        initialization of the gain estimation, and the previous
+        LAR coefficients are used as initialization of the Newton-Raphson
+        refinement (when iter_newton > 0). It is ignored in the order
+        selection (when criterion is not None), where each model of the
+        grid is estimated from scratch.
     """
     # ------------------------------------------------ #
     # Functions that overload abstract methods         #
@@ -106,9 +138,10 @@ class StableDAR(BaseLattice):
         e_forward = self.forward_residual
         e_backward = self.backward_residual
         _, n_epochs, n_points = e_forward.shape
+        p, p_1 = self._stage(p), self._stage(p - 1)
 
-        g = e_forward[p, :, 1:n_points] * e_backward[p - 1, :, 0:n_points - 1]
-        g += e_backward[p, :, 1:n_points] * e_forward[p - 1, :, 1:n_points]
+        g = e_forward[p, :, 1:n_points] * e_backward[p_1, :, 0:n_points - 1]
+        g += e_backward[p, :, 1:n_points] * e_forward[p_1, :, 1:n_points]
         g *= 0.5 * (1.0 - ki[:, 1:n_points] ** 2)   # phi'[k[p,t]])
         return np.reshape(g, (n_epochs, n_points - 1))
 
@@ -133,13 +166,14 @@ class StableDAR(BaseLattice):
         e_forward = self.forward_residual
         e_backward = self.backward_residual
         _, n_epochs, n_points = e_forward.shape
+        p, p_1 = self._stage(p), self._stage(p - 1)
 
-        h1 = e_forward[p - 1, :, 1:n_points] ** 2
-        h1 += e_backward[p - 1, :, 0:n_points - 1] ** 2
+        h1 = e_forward[p_1, :, 1:n_points] ** 2
+        h1 += e_backward[p_1, :, 0:n_points - 1] ** 2
         h1 *= (0.5 * (1.0 - ki[:, 1:n_points] ** 2)) ** 2
 
-        h2 = e_forward[p, :, 1:n_points] * e_backward[p - 1, :, 0:n_points - 1]
-        h2 += e_backward[p, :, 1:n_points] * e_forward[p - 1, :, 1:n_points]
+        h2 = e_forward[p, :, 1:n_points] * e_backward[p_1, :, 0:n_points - 1]
+        h2 += e_backward[p, :, 1:n_points] * e_forward[p_1, :, 1:n_points]
         h2 *= (-0.5 * ki[:, 1:n_points] * (1.0 - ki[:, 1:n_points] ** 2))
 
         return np.reshape(h1 + h2, (n_epochs, n_points - 1))
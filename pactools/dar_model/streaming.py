@@ -0,0 +1,100 @@
+import numpy as np
+
+from .base_lattice import BaseLattice
+from .lattice_kernels import lattice_whiten
+from ..utils.validation import check_array, check_consistent_shape
+from ..utils.validation import check_is_fitted
+
+
+class StreamingWhitener(object):
+    """Whiten a continuous signal block by block, with a fitted DAR model
+
+    Contrary to the model's transform method, the signal is given in
+    successive blocks, and the whitener keeps the state of the filter
+    between two blocks. The concatenation of the residuals of all blocks
+    is thus identical to the residual of the full signal, while the memory
+    only depends on the size of the blocks.
+
+    The signal is not centered, since its mean is not known in advance.
+
+    Parameters
+    ----------
+    model : instance of DAR, HAR, AR or StableDAR
+        The fitted model used to whiten the signal
+
+    Attributes
+    ----------
+    state_ : None or array
+        State of the filter after the last block. For a lattice model
+        (StableDAR), it contains the backward residual entering each cell,
+        with shape (ordar_, n_epochs). For the other models, it contains the
+        last ordar_ samples of the signal, with shape (n_epochs, ordar_).
+        It is None before the first block.
+    """
+
+    def __init__(self, model):
+        check_is_fitted(model, 'AR_')
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        """Forget the state, to start whitening a new signal"""
+        self.state_ = None
+        return self
+
+    def transform(self, sigin, sigdriv, sigdriv_imag=None):
+        """Whiten the next block of signal
+
+        Parameters
+        ----------
+        sigin : array, shape (n_epochs, n_points) or (n_points, )
+            Next block of the signal to whiten
+
+        sigdriv : array, shape (n_epochs, n_points) or (n_points, )
+            Next block of the driver
+
+        sigdriv_imag : None or array, shape (n_epochs, n_points)
+            Next block of the second driver, containing the imaginary part
+            of the driver
+
+        Returns
+        -------
+        residual : array, shape (n_epochs, n_points)
+            Residual (whitened signal) of this block
+        """
+        sigin = check_array(sigin)
+        sigdriv = check_array(sigdriv)
+        sigdriv_imag = check_array(sigdriv_imag, accept_none=True)
+        check_consistent_shape(sigin, sigdriv, sigdriv_imag)
+
+        model = self.model
+        ordar_ = model.ordar_
+        n_epochs, n_points = sigin.shape
+        lattice = isinstance(model, BaseLattice)
+        shape = (ordar_, n_epochs) if lattice else (n_epochs, ordar_)
+        if self.state_ is None:
+            self.state_ = np.zeros(shape)
+        elif self.state_.shape != shape:
+            raise ValueError('Invalid number of epochs: got %d, which differs'
+                             ' from the previous blocks.' % n_epochs)
+
+        basis = model._make_basis(sigdriv=sigdriv, sigdriv_imag=sigdriv_imag,
+                                  ordriv=model.ordriv_)
+
+        if lattice:
+            # the state is updated inplace
+            parcor_list = model.decode(model._develop_parcor(model.AR_,
+                                                             basis))
+            residual, _ = lattice_whiten(parcor_list, sigin,
+                                         delayed=self.state_)
+            return residual
+
+        # -------- prepend the last samples of the previous block
+        sigext = np.hstack((self.state_, sigin))
+        AR_cols, _ = model._develop(basis)
+        residual = np.copy(sigin)
+        for k in range(1, ordar_ + 1):
+            residual += AR_cols[k] * sigext[:, ordar_ - k:ordar_ - k +
+                                            n_points]
+        self.state_ = np.copy(sigext[:, sigext.shape[1] - ordar_:])
+        return residual
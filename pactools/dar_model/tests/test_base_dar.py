@@ -1,10 +1,16 @@
+import pickle
+
 import numpy as np
 import matplotlib.pyplot as plt
 
 from pactools.utils.testing import assert_equal, assert_array_almost_equal
-from pactools.utils.testing import assert_greater, assert_raises
+from pactools.utils.testing import assert_greater, assert_raises, assert_true
 from pactools.utils.testing import assert_array_not_almost_equal
-from pactools.dar_model import DAR, AR, HAR, StableDAR
+from pactools.dar_model import DAR, AR, HAR, StableDAR, StreamingWhitener
+from pactools.dar_model.lattice_kernels import _cell_numpy, _cell_loop
+from pactools.dar_model.lattice_kernels import _whiten_loop, _synthesize_loop
+from pactools.dar_model.lattice_kernels import lattice_synthesize
+from pactools.dar_model.lattice_kernels import lattice_whiten
 from pactools.simulate_pac import simulate_pac
 
 ALL_MODELS = [DAR, AR, HAR, StableDAR]
@@ -31,6 +37,11 @@ _noise = np.random.RandomState(0).randn(n_points)
 _model_params = {'ordar': 10, 'ordriv': 2, 'criterion': False}
 
 
+def py_func(kernel):
+    # pure Python version of a kernel, even if it is compiled with numba
+    return getattr(kernel, 'py_func', kernel)
+
+
 def fast_fitted_model(klass=DAR, model_params=_model_params, sigin=_sigin,
                       sigdriv=_sigdriv, sigdriv_imag=_sigdriv_imag, fs=fs,
                       train_weights=None, test_weights=None):
@@ -109,6 +120,26 @@ def dar_no_fit(ortho, normalize, sigdriv=_sigdriv, sigdriv_imag=_sigdriv_imag,
     return dar
 
 
+def test_make_basis_ill_conditioned():
+    # Test the orthonormalization on a badly conditioned driver, against a
+    # direct QR decomposition of the raw basis
+    ordriv = 4
+    sigdriv = 1. + 0.3 * _sigdriv / _sigdriv.std()
+    dar = DAR(ordar=5, ordriv=ordriv, criterion=False)
+    dar.sigin = _sigin[None, :]
+    dar.sigdriv = sigdriv[None, :]
+    dar.sigdriv_imag = None
+    dar._make_basis()
+    basis = dar.basis_.reshape(ordriv + 1, -1)
+
+    raw_basis = np.array([sigdriv ** k for k in range(ordriv + 1)])
+    Q, R = np.linalg.qr(raw_basis.T)
+    expected = (Q * np.sign(np.diag(R))).T * np.sqrt(sigdriv.size)
+    assert_array_almost_equal(basis, expected)
+    assert_array_almost_equal(np.dot(basis, basis.T) / sigdriv.size,
+                              np.eye(ordriv + 1), decimal=12)
+
+
 def test_make_basis_new_sigdriv():
     # Test that _make_basis works the same with a new sigdriv,
     # using stored orthonormalization transform.
@@ -219,3 +250,330 @@ def test_weighting_with_zeros():
             assert_array_almost_equal(
                 model_0._estimate_log_likelihood(train=train),
                 model_1._estimate_log_likelihood(train=train), decimal=5)
+
+
+def test_lattice_kernels():
+    # Test that the loop kernels and the NumPy implementations are equivalent
+    rng = np.random.RandomState(0)
+    ordar, n_epochs, n_points = 4, 2, 50
+    parcor_list = np.tanh(rng.randn(ordar, n_epochs, n_points))
+    sigin = rng.randn(n_epochs, n_points)
+    gain = np.exp(rng.randn(n_epochs, n_points) * 0.1)
+    excitation = rng.randn(n_epochs, n_points)
+
+    f_ref, b_ref = _cell_numpy(parcor_list[0], sigin, sigin[:, ::-1])
+    f_res, b_res = np.empty_like(sigin), np.empty_like(sigin)
+    py_func(_cell_loop)(parcor_list[0], sigin, sigin[:, ::-1], f_res, b_res)
+    assert_array_almost_equal(f_res, f_ref)
+    assert_array_almost_equal(b_res, b_ref)
+
+    f_ref, b_ref = sigin, sigin
+    for parcor in parcor_list:
+        f_ref, b_ref = _cell_numpy(parcor, f_ref, b_ref)
+    delayed = np.zeros((ordar, n_epochs))
+    py_func(_whiten_loop)(parcor_list, sigin, f_res, b_res, delayed)
+    assert_array_almost_equal(f_res, f_ref)
+    assert_array_almost_equal(b_res, b_ref)
+
+    # whiten in two blocks, keeping the state of the filter
+    half = n_points // 2
+    delayed = np.zeros((ordar, n_epochs))
+    delayed_loop = np.zeros((ordar, n_epochs))
+    f_res = np.empty((n_epochs, n_points - half))
+    b_res = np.empty((n_epochs, n_points - half))
+    for block in (slice(0, half), slice(half, n_points)):
+        f_block, b_block = lattice_whiten(parcor_list[:, :, block],
+                                          sigin[:, block], delayed)
+        assert_array_almost_equal(f_block, f_ref[:, block])
+        assert_array_almost_equal(b_block, b_ref[:, block])
+        py_func(_whiten_loop)(parcor_list[:, :, block], sigin[:, block],
+                              f_res, b_res, delayed_loop)
+        assert_array_almost_equal(f_res, f_ref[:, block])
+        assert_array_almost_equal(delayed_loop, delayed)
+
+    for tburn in (0, ordar):
+        sigout = np.zeros((n_epochs, n_points - tburn))
+        py_func(_synthesize_loop)(parcor_list, gain, excitation, tburn,
+                                  sigout)
+        assert_array_almost_equal(
+            sigout, lattice_synthesize(parcor_list, gain, excitation, tburn))
+
+
+def test_lattice_whiten_synthesize():
+    # Test that whiten matches the residual stored during the fit, and that
+    # the synthesis inverts the whitening filter
+    model = fast_fitted_model(StableDAR)
+    residual, _ = model.whiten()
+    assert_array_almost_equal(residual, model.forward_residual[-1])
+
+    cell_residual = model.sigin
+    cell_backward = model.sigin
+    for k in range(model.ordar_):
+        parcor_list = model.decode(
+            model._develop_parcor(model.AR_[k], model.basis_))
+        cell_residual, cell_backward = model.cell(parcor_list, cell_residual,
+                                                  cell_backward)
+    assert_array_almost_equal(residual, cell_residual)
+
+    gain = model._develop_gain(model.basis_, squared=False, log=False)
+    sigout = model.synthesize(residual / gain)
+    assert_array_almost_equal(sigout, model.sigin)
+
+
+def test_estimate_gain():
+    # Test that the gain estimation does not modify the residual, and that
+    # a subsampled initial estimation converges to the same gain
+    for klass in ALL_MODELS:
+        model_0 = fast_fitted_model(klass=klass)
+        residual = np.copy(model_0.residual_)
+        G_ = np.copy(model_0.G_)
+        model_0._estimate_gain()
+        assert_array_almost_equal(model_0.residual_, residual, decimal=15)
+        assert_array_almost_equal(model_0.G_, G_)
+
+        # a too small subsample keeps enough points in each slice
+        for n_points_gain_init in [n_points // 4, 5]:
+            model_params = dict(_model_params,
+                                n_points_gain_init=n_points_gain_init)
+            model_1 = fast_fitted_model(klass=klass,
+                                        model_params=model_params)
+            assert_array_almost_equal(model_1.G_, model_0.G_, decimal=3)
+
+
+def test_warm_start():
+    # Test that warm_start converges to the same model with less iterations
+    for klass in ALL_MODELS:
+        model_params = dict(_model_params, iter_gain=20, eps_gain=1e-8)
+        if klass == StableDAR:
+            model_params['iter_newton'] = 20
+        model_0 = fast_fitted_model(klass=klass, model_params=model_params)
+
+        model_params['warm_start'] = True
+        model_1 = fast_fitted_model(klass=klass, model_params=model_params)
+        model_1.fit(sigin=_sigin, sigdriv=_sigdriv,
+                    sigdriv_imag=_sigdriv_imag, fs=fs)
+
+        assert_array_almost_equal(model_1.AR_, model_0.AR_, decimal=3)
+        assert_array_almost_equal(model_1.G_, model_0.G_, decimal=5)
+        assert_greater(model_0.n_iter_gain_, model_1.n_iter_gain_)
+        if klass == StableDAR:
+            assert_greater(model_0.n_iter_newton_.sum(),
+                           model_1.n_iter_newton_.sum())
+
+
+def test_amplitude_frequency_direct_evaluation():
+    # Test that the direct evaluation of the spectrum matches the FFT grid
+    n_fft = 64
+    frequencies = np.linspace(0, fs / 2, n_fft // 2 + 1)
+    for klass in ALL_MODELS:
+        model = fast_fitted_model(klass=klass)
+        spec_fft = model._amplitude_frequency(n_fft=n_fft)[0]
+        spec = model._amplitude_frequency(frequencies=frequencies)[0]
+        assert_array_almost_equal(spec, spec_fft)
+
+        spec = model._amplitude_frequency(frequencies=frequencies[1:3])[0]
+        assert_array_almost_equal(spec, spec_fft[1:3])
+
+
+def test_make_basis_cache():
+    # Test that the cached basis is reused only with the same driver
+    model_params = {'ordar': 5, 'ordriv': 2, 'criterion': False}
+    for normalize in (True, False):
+        for ortho in (True, False):
+            dar = dar_no_fit(ortho, normalize, **model_params)
+            dar_cache = dar_no_fit(ortho, normalize, cache_basis=True,
+                                   **model_params)
+            basis = dar_cache.basis_
+            assert_array_almost_equal(basis, dar.basis_)
+
+            # same driver: the basis is not computed again
+            dar_cache._make_basis()
+            assert_true(dar_cache.basis_.base is basis.base)
+            newbasis = dar_cache._make_basis(sigdriv=_sigdriv,
+                                             sigdriv_imag=_sigdriv_imag)
+            assert_array_almost_equal(newbasis, dar.basis_)
+
+            # different driver: the basis is computed again
+            newbasis = dar_cache._make_basis(sigdriv=_noise,
+                                             sigdriv_imag=_noise[::-1])
+            assert_array_almost_equal(newbasis, dar._make_basis(
+                sigdriv=_noise, sigdriv_imag=_noise[::-1]))
+            dar_cache.sigdriv = _noise[None, :]
+            dar_cache._make_basis()
+            assert_true(dar_cache.basis_.base is not basis.base)
+
+    model_0 = fast_fitted_model(DAR)
+    model_1 = fast_fitted_model(
+        DAR, model_params=dict(_model_params, cache_basis=True))
+    basis = model_1.basis_
+    model_1.fit(sigin=_sigin, sigdriv=_sigdriv, sigdriv_imag=_sigdriv_imag,
+                fs=fs)
+    assert_true(model_1.basis_.base is basis.base)
+    assert_array_almost_equal(model_1.AR_, model_0.AR_)
+    assert_array_almost_equal(model_1.G_, model_0.G_)
+
+
+def test_masked_data_selection():
+    # Test that the selection of the masked data is computed once, as slices
+    # when it is contiguous, and gives the same data as a boolean selection
+    model = DAR(**_model_params)
+    n_epochs = 4
+    sigin = np.arange(n_epochs * n_points, dtype=float).reshape(n_epochs, -1)
+    ordar = _model_params['ordar']
+    for contiguous, split in ((True, np.arange(n_points) < n_points // 2),
+                              (False, np.arange(n_points) % 200 < 100)):
+        mask = np.zeros_like(sigin, dtype=bool)
+        mask[1:3] = split
+        mask[0] = mask[3] = True
+        selection = model._compute_selection(mask)
+        epoch_selection, time_selection = selection
+        assert_equal(epoch_selection, slice(1, 3))
+        if contiguous:
+            # the unmasked second half, and the ordar samples before it
+            assert_equal(time_selection, slice(n_points // 2 - ordar,
+                                               n_points))
+        else:
+            assert_true(not isinstance(time_selection, slice))
+
+        sigin_selected = model._remove_far_masked_data(
+            mask, [sigin], selection=selection)[0]
+        time_mask = np.zeros(n_points, dtype=bool)
+        time_mask[time_selection] = True
+        assert_array_almost_equal(sigin_selected, sigin[1:3][:, time_mask])
+
+    train_weights = np.ones_like(_sigin)
+    train_weights[n_points // 4:n_points // 2] = 0
+    train_weights[3 * n_points // 4:] = 0
+    model = fast_fitted_model(train_weights=train_weights)
+    # the far masked data is removed in the fit, so the training data is now
+    # selected with slices, without copy
+    epoch_selection, time_selection = model.train_selection_
+    assert_true(isinstance(time_selection, slice))
+    sigin_train = model._get_train_data([model.sigin])[0]
+    assert_true(np.may_share_memory(sigin_train, model.sigin))
+
+
+def test_fit_multichannel():
+    # Test that fitting several channels at once is identical to fitting
+    # each channel independently
+    sigins = np.array([_sigin, _noise, _sigin + _noise])
+    train_weights = np.ones_like(_sigin)
+    train_weights[n_points // 2:] = 0
+    for klass in ALL_MODELS:
+        for model_params in (_model_params,
+                             dict(_model_params, criterion='bic')):
+            if klass == StableDAR:
+                model_params = dict(model_params, iter_newton=10)
+            model = klass(**model_params)
+            model.fit_multichannel(sigin=sigins, sigdriv=_sigdriv,
+                                   sigdriv_imag=_sigdriv_imag, fs=fs,
+                                   train_weights=train_weights)
+            n_channels = sigins.shape[0]
+            assert_equal(model.AR_multichannel_.shape[0], n_channels)
+            assert_equal(model.G_multichannel_.shape[0], n_channels)
+
+            for channel, sigin in enumerate(sigins):
+                model_0 = fast_fitted_model(
+                    klass=klass, model_params=model_params, sigin=sigin,
+                    train_weights=train_weights)
+                ordar_, n_basis = model_0.AR_.shape
+                AR_ = model.AR_multichannel_[channel]
+                assert_array_almost_equal(AR_[:ordar_, :n_basis],
+                                          model_0.AR_)
+                assert_array_almost_equal(AR_[ordar_:], 0)
+                assert_array_almost_equal(
+                    model.G_multichannel_[channel, :, :n_basis], model_0.G_)
+                assert_equal(model.ordriv_multichannel_[channel],
+                             model_0.ordriv_)
+                for key in ('logl', 'aic', 'bic'):
+                    assert_array_almost_equal(
+                        model.criterions_multichannel_[key][channel],
+                        model_0.get_criterion(key))
+
+
+def test_low_memory_and_parallel_order_selection():
+    # Test that low_memory and n_jobs do not change the fitted model
+    model_params = dict(_model_params, criterion='bic', iter_newton=10)
+    model_0 = fast_fitted_model(StableDAR, model_params=model_params)
+    for low_memory, n_jobs in ((True, 1), (False, 2), (True, 2)):
+        model_1 = fast_fitted_model(StableDAR, model_params=dict(
+            model_params, low_memory=low_memory, n_jobs=n_jobs))
+        assert_array_almost_equal(model_1.AR_, model_0.AR_)
+        assert_array_almost_equal(model_1.G_, model_0.G_)
+        assert_array_almost_equal(model_1.residual_, model_0.residual_)
+        for key in ('logl', 'aic', 'bic'):
+            assert_array_almost_equal(
+                model_1.model_selection_criterions_[key],
+                model_0.model_selection_criterions_[key])
+
+    model_params = dict(_model_params, iter_newton=10)
+    model_0 = fast_fitted_model(StableDAR, model_params=model_params)
+    model_1 = fast_fitted_model(StableDAR, model_params=dict(
+        model_params, low_memory=True))
+    assert_equal(model_1.forward_residual.shape[0], 2)
+    assert_array_almost_equal(model_1.AR_, model_0.AR_)
+    assert_array_almost_equal(model_1.residual_, model_0.residual_)
+
+    model_params = dict(_model_params, criterion='bic')
+    model_0 = fast_fitted_model(DAR, model_params=model_params)
+    model_1 = fast_fitted_model(DAR, model_params=dict(model_params,
+                                                       n_jobs=2))
+    assert_array_almost_equal(model_1.AR_, model_0.AR_)
+    assert_array_almost_equal(model_1.G_, model_0.G_)
+
+
+def test_state_and_release_training_data():
+    # Test that a model recovered from its state, or without its training
+    # data, gives the same spectra and residuals
+    for klass in ALL_MODELS:
+        for sigdriv_imag in (None, _sigdriv_imag):
+            model = fast_fitted_model(klass=klass, sigdriv_imag=sigdriv_imag)
+            spec, xlim, _, _ = model._amplitude_frequency()
+            residual = model.transform(_noise, _sigdriv, fs, sigdriv_imag)
+
+            state = pickle.loads(pickle.dumps(model.to_state()))
+            assert_true('sigin' not in state['attributes'])
+            model_1 = klass.from_state(state)
+            model_2 = fast_fitted_model(klass=klass, sigdriv_imag=sigdriv_imag)
+            model_2.release_training_data()
+            assert_true(model_2.sigin is None)
+            assert_true(not hasattr(model_2, 'residual_'))
+            for model_ in (model_1, model_2):
+                assert_equal(model_.get_title(), model.get_title())
+                assert_array_almost_equal(model_.AR_, model.AR_)
+                spec_, xlim_, _, _ = model_._amplitude_frequency()
+                assert_array_almost_equal(xlim_, xlim)
+                assert_array_almost_equal(spec_, spec)
+                assert_array_almost_equal(
+                    model_.transform(_noise, _sigdriv, fs, sigdriv_imag),
+                    residual)
+
+    assert_raises(ValueError, DAR.from_state, model.to_state())
+
+    # copy does not modify the model
+    keys = sorted(model.__dict__.keys())
+    model.copy()
+    assert_equal(sorted(model.__dict__.keys()), keys)
+
+
+def test_streaming_whitener():
+    # Test that whitening a signal block by block gives the same residual as
+    # the transform of the full signal
+    sigin = _noise - np.mean(_noise)
+    blocks = [slice(0, 5), slice(5, 300), slice(300, 303),
+              slice(303, n_points)]
+    for klass in ALL_MODELS:
+        for sigdriv_imag in (None, _sigdriv_imag):
+            model = fast_fitted_model(klass=klass, sigdriv_imag=sigdriv_imag)
+            residual = model.transform(sigin, _sigdriv, fs, sigdriv_imag)
+
+            whitener = StreamingWhitener(model)
+            residual_blocks = []
+            for block in blocks:
+                residual_blocks.append(whitener.transform(
+                    sigin[block], _sigdriv[block],
+                    None if sigdriv_imag is None else sigdriv_imag[block]))
+            assert_array_almost_equal(np.hstack(residual_blocks), residual)
+
+            assert_raises(ValueError, whitener.transform,
+                          np.tile(sigin, (2, 1)), np.tile(_sigdriv, (2, 1)))
@@ -1,10 +1,14 @@
+from multiprocessing import cpu_count
+
 import numpy as np
 import matplotlib.pyplot as plt
 
 from .utils.validation import check_consistent_shape, check_array
 from .utils.validation import check_is_fitted
 
-from .dar_model import extract_driver
+from .dar_model import DAR, extract_driver
+from .utils.maths import roll
+from .utils.parallel import Parallel, delayed
 from .utils.progress_bar import ProgressBar
 from .utils.viz import SEABORN_PALETTES
 
@@ -38,6 +42,17 @@ class DelayEstimator(object):
     refit : boolean, default True
         If True, the model will be refitted with the best delay obtained
 
+    search : {'exhaustive', 'coarse_to_fine'}, default 'exhaustive'
+        If 'exhaustive', the model is fitted for every delay of the grid.
+        If 'coarse_to_fine', the model is first fitted on a coarse subgrid,
+        and then for every delay around the best coarse delay. The delays
+        that are not evaluated have a NaN negative log-likelihood.
+
+    n_jobs : int
+        Number of jobs to use in parallel over the delays. Each job fits its
+        own copy of dar_model, on a contiguous chunk of delays.
+        Requires joblib or scikit-learn installed.
+
     random_state : None, int or np.random.RandomState instance
         Seed or random number generator for the surrogate analysis.
 
@@ -48,7 +63,8 @@ class DelayEstimator(object):
     """
 
     def __init__(self, fs, dar_model, low_fq, low_fq_width, max_delay='auto',
-                 refit=True, random_state=None):
+                 refit=True, random_state=None, search='exhaustive',
+                 n_jobs=1):
         self.fs = fs
         self.dar_model = dar_model
         self.low_fq = low_fq
@@ -56,6 +72,8 @@ class DelayEstimator(object):
         self.max_delay = max_delay
         self.refit = refit
         self.random_state = random_state
+        self.search = search
+        self.n_jobs = n_jobs
 
     def fit(self, low_sig, high_sig=None, mask=None):
         """
@@ -78,11 +96,14 @@ class DelayEstimator(object):
         ----------
         neg_log_likelihood_ : array, shape (n_delays, )
             Negative log-likelihood of dar_model, fitted on a grid of delays
-            self.delays_ms_
+            self.delays_ms_. It is NaN for the delays that are not evaluated.
 
         delays_ms_ : array, shape (n_delays, )
             Temporal delays (in ms), corresponding to self.neg_log_likelihood_
 
+        evaluated_delays_ms_ : array, shape (n_evaluated, )
+            Temporal delays (in ms) where the model has been fitted
+
         best_delay_ms_ : float
             Temporal delay corresponding to the minimum negative log-likelihood
 
@@ -122,31 +143,44 @@ class DelayEstimator(object):
         # delay in time points
         delays_point = np.arange(max_delay_point + 1)
         delays_point = np.r_[-delays_point[:0:-1], delays_point]
-        bar = ProgressBar(title='delays', max_value=len(delays_point))
+        n_delays = len(delays_point)
         self.delays_ms_ = delays_point / self.fs * 1000.
 
         train_weights = (1. - self.mask) if self.mask is not None else None
+        signals = (sigin, sigdriv, sigdriv_imag, train_weights)
+
+        neg_log_likelihood = np.full(n_delays, np.nan)
+        if self.search == 'exhaustive':
+            bar = ProgressBar(title='delays', max_value=n_delays)
+            evaluated = np.arange(n_delays)
+            neg_log_likelihood[evaluated] = self._scan_delays(
+                delays_point[evaluated], *signals, bar=bar)
+
+        elif self.search == 'coarse_to_fine':
+            # evaluate a coarse grid, including both ends
+            step = max(int(np.sqrt(n_delays)), 1)
+            coarse = np.unique(np.r_[np.arange(0, n_delays, step),
+                                     n_delays - 1])
+            bar = ProgressBar(title='delays',
+                              max_value=len(coarse) + 2 * (step - 1))
+            neg_log_likelihood[coarse] = self._scan_delays(
+                delays_point[coarse], *signals, bar=bar)
+
+            # refine around the best coarse delay
+            i_best = coarse[np.nanargmin(neg_log_likelihood[coarse])]
+            fine = np.arange(max(i_best - step + 1, 0),
+                             min(i_best + step, n_delays))
+            fine = np.setdiff1d(fine, coarse)
+            neg_log_likelihood[fine] = self._scan_delays(
+                delays_point[fine], *signals, bar=bar)
+            evaluated = np.union1d(coarse, fine)
 
-        neg_log_likelihood = np.zeros(len(delays_point))
-        for i_delay, delay in enumerate(delays_point):
-            # add delay
-            sigdriv_ = np.roll(sigdriv, delay, axis=1)
-            sigdriv_imag_ = np.roll(sigdriv_imag, delay, axis=1)
-
-            # fit the model direct
-            model.fit(sigin=sigin, sigdriv=sigdriv_,
-                      sigdriv_imag=sigdriv_imag_, fs=self.fs,
-                      train_weights=train_weights)
-            neg_log_likelihood[i_delay] = model.get_criterion('-logl')
-            # fit the model reverted
-            model.fit(sigin=sigin[..., ::-1], sigdriv=sigdriv_[..., ::-1],
-                      sigdriv_imag=sigdriv_imag_[..., ::-1], fs=self.fs,
-                      train_weights=train_weights)
-            neg_log_likelihood[i_delay] += model.get_criterion('-logl')
-
-            bar.update(i_delay + 1)
+        else:
+            raise ValueError("search should be 'exhaustive' or "
+                             "'coarse_to_fine', got %r." % (self.search, ))
         bar.close()
         self.neg_log_likelihood_ = neg_log_likelihood
+        self.evaluated_delays_ms_ = self.delays_ms_[evaluated]
 
         # compute the best delay
         i_best = np.nanargmin(neg_log_likelihood)
@@ -164,6 +198,29 @@ class DelayEstimator(object):
 
         return self
 
+    def _scan_delays(self, delays_point, sigin, sigdriv, sigdriv_imag,
+                     train_weights, bar=None):
+        """Fit the model for each delay, possibly in parallel"""
+        model = self.dar_model
+        if self.n_jobs == 1:
+            return _fit_delays(model, self.fs, delays_point, sigin, sigdriv,
+                               sigdriv_imag, train_weights, bar=bar)
+
+        # split the delays in contiguous chunks, one per job
+        n_chunks = self.n_jobs if self.n_jobs > 0 else cpu_count()
+        n_chunks = min(n_chunks, len(delays_point))
+        chunks = np.array_split(delays_point, n_chunks)
+
+        # the input signals are shared with the workers (through memory
+        # mapping) by joblib, and the results are returned in order
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_delays)(_clone_model(model), self.fs, chunk, sigin,
+                                 sigdriv, sigdriv_imag, train_weights)
+            for chunk in chunks)
+        if bar is not None:
+            bar.update_with_increment_value(len(delays_point))
+        return np.concatenate(results)
+
     def plot(self, ax=None, write_tau=True):
         """
         Returns
@@ -181,7 +238,9 @@ class DelayEstimator(object):
         blue, green, red, purple, yellow, cyan = SEABORN_PALETTES['deep']
 
         i_best = np.nanargmin(self.neg_log_likelihood_)
-        ax.plot(self.delays_ms_, self.neg_log_likelihood_, color=purple)
+        evaluated = ~np.isnan(self.neg_log_likelihood_)
+        ax.plot(self.delays_ms_[evaluated],
+                self.neg_log_likelihood_[evaluated], color=purple)
         ax.plot(self.delays_ms_[i_best], self.neg_log_likelihood_[i_best], 'D',
                 color=red)
         ax.set_xlabel('Delay (ms)')
@@ -196,3 +255,79 @@ class DelayEstimator(object):
                     transform=ax.transAxes)
 
         return fig
+
+
+def _fit_delays(model, fs, delays_point, sigin, sigdriv, sigdriv_imag,
+                train_weights, bar=None):
+    """Fit the model for each delay, on the direct and reversed signals
+
+    The basis of a delayed driver is equal to the delayed basis of the
+    driver, so the basis is computed only once, and rolled for each
+    delay. With a DAR model, the regression moments are also computed
+    for all delays at once, since the lagged products of sigin do not
+    depend on the delay. If the masked data are cropped, the basis
+    depends on the delay, and the model is fully fitted for each delay.
+
+    Returns
+    -------
+    neg_log_likelihood : array, shape (len(delays_point), )
+        Sum of the negative log-likelihood of both fits, for each delay
+    """
+    neg_log_likelihood = np.zeros(len(delays_point))
+    for reverse in (False, True):
+        flip = slice(None, None, -1 if reverse else 1)
+        sigin_ = sigin[..., flip]
+        sigdriv_ = sigdriv[..., flip]
+        sigdriv_imag_ = sigdriv_imag[..., flip]
+        train_weights_ = (train_weights[..., flip]
+                          if train_weights is not None else None)
+
+        # check the arrays and compute the basis only once
+        model._reset_criterions()
+        model._check_all_arrays(sigin_, sigdriv_, sigdriv_imag_,
+                                train_weights_, None)
+        model.fs = fs
+        reuse_basis = model.sigin.size == sigin_.size
+        if reuse_basis:
+            model._make_basis()
+            basis, alpha = model.basis_, model.alpha_
+            # the rolled basis are all written in the same array
+            basis_rolled = np.empty(basis.shape)
+
+        # the delay is applied before reversing the signals
+        shifts = -delays_point if reverse else delays_point
+        reuse_moments = (reuse_basis and isinstance(model, DAR) and
+                         not model.criterion and model.ordar > 0 and
+                         model._get_train_data([model.sigin])[0].size ==
+                         model.sigin.size)
+        if reuse_moments:
+            R, r = model._delayed_moments(shifts)
+
+        for i_delay, shift in enumerate(shifts):
+            if reuse_basis:
+                model._reset_criterions()
+                model.basis_ = roll(basis, shift, axis=-1, out=basis_rolled)
+                model.alpha_ = alpha
+                if reuse_moments:
+                    model._fit_from_moments(R[i_delay], r[i_delay])
+                else:
+                    model._fit_model(make_basis=False)
+            else:
+                model.fit(sigin=sigin_,
+                          sigdriv=np.roll(sigdriv_, shift, axis=1),
+                          sigdriv_imag=np.roll(sigdriv_imag_, shift,
+                                               axis=1),
+                          fs=fs, train_weights=train_weights_)
+            neg_log_likelihood[i_delay] += model.get_criterion('-logl')
+
+            if bar is not None:
+                bar.update_with_increment_value(0.5)
+
+    return neg_log_likelihood
+
+
+def _clone_model(model):
+    """Create an unfitted copy of a model, with the same parameters"""
+    params = dict((name, getattr(model, name))
+                  for name in model._get_param_names())
+    return model.__class__(**params)
@@ -80,26 +80,25 @@ class PeakLocking(object):
             The locking is only evaluated where the mask is False.
             Masking is done after filtering.
 
-        ax_draw_peaks : boolean or matplotlib.axes.Axes instance
-            If True, plot the first peaks/troughs in the phase signal
-            Plot on the matplotlib.axes.Axes instance if given, or on a
-            new figure.
-
         Attributes
         ----------
         time_frequency_ : array, shape (n_high, n_window)
             Time-frequency representation, averaged with peak-locking.
             (n_window is the number of point in t_plot seconds)
+            If low_fq is a list, the shape is (n_low, n_high, n_window).
 
         time_average_ : array, shape (n_percentiles, n_window)
             Time representation, averaged with peak-locking.
             (n_window is the number of point in t_plot seconds)
+            If low_fq is a list, the shape is (n_low, n_percentiles,
+            n_window).
         """
-        self.low_fq = np.atleast_1d(self.low_fq)
+        low_fq_range = np.atleast_1d(self.low_fq)
         if self.high_fq_range == 'auto':
-            self.high_fq_range = np.linspace(self.low_fq[0], self.fs / 2.0, 40)
+            self.high_fq_range = np.linspace(low_fq_range[0], self.fs / 2.0,
+                                             40)
         if self.high_fq_width == 'auto':
-            self.high_fq_width = 2 * self.low_fq[0]
+            self.high_fq_width = 2 * low_fq_range[0]
         self.high_fq_range = np.asarray(self.high_fq_range)
 
         self.low_sig = check_array(low_sig)
@@ -110,57 +109,96 @@ class PeakLocking(object):
         self.mask = check_array(mask, accept_none=True)
         check_consistent_shape(self.low_sig, self.high_sig, self.mask)
 
-        # compute the slow oscillation
-        # 1, n_epochs, n_points = filtered_low.shape
-        filtered_low = multiple_band_pass(low_sig, self.fs, self.low_fq,
+        # compute the slow oscillations
+        # n_low, n_epochs, n_points = filtered_low.shape
+        filtered_low = multiple_band_pass(low_sig, self.fs, low_fq_range,
                                           self.low_fq_width,
                                           filter_method=self.filter_method)
-        self.filtered_low_ = filtered_low[0]
-        filtered_low_real = np.real(self.filtered_low_)
+
+        # extract several signals with band-pass filters
+        # n_high, n_epochs, n_points = filtered_high.shape
+        self.filtered_high_ = multiple_band_pass(
+            self.high_sig, self.fs, self.high_fq_range, self.high_fq_width,
+            n_cycles=None, filter_method=self.filter_method)
+
+        peak_loc_list, peak_mag_list, time_average_list = [], [], []
+        for this_filtered_low in filtered_low:
+            peak_loc, peak_mag = self._find_peaks(this_filtered_low)
+            peak_loc_list.append(peak_loc)
+            peak_mag_list.append(peak_mag)
+
+            # compute the peak locked time representation
+            # we don't need the mask here, since only the valid peak
+            # locations are kept in the peak finder
+            time_average_list.append(peak_locked_percentile(
+                self.low_sig[None, :], self.fs, peak_loc, self.t_plot,
+                self.percentiles)[0, :, :])
+
+        # compute the peak locked time-frequency representations, with
+        # each high frequency band normalized only once for all low_fq
+        time_frequency_list = _peak_locked_time_frequency(
+            self.filtered_high_, self.fs, peak_loc_list, self.t_plot,
+            mask=self.mask)
+
+        if np.ndim(self.low_fq) == 0:
+            self.filtered_low_ = filtered_low[0]
+            self.peak_loc = peak_loc_list[0]
+            self.peak_mag = peak_mag_list[0]
+            self.time_frequency_ = time_frequency_list[0]
+            self.time_average_ = time_average_list[0]
+        else:
+            self.filtered_low_ = filtered_low
+            self.peak_loc = peak_loc_list
+            self.peak_mag = peak_mag_list
+            self.time_frequency_ = np.array(time_frequency_list)
+            self.time_average_ = np.array(time_average_list)
+
+        return self
+
+    def _find_peaks(self, filtered_low):
+        """Find the peaks (or troughs) of one filtered slow oscillation"""
+        filtered_low_real = np.real(filtered_low)
 
         if False:
             # find the peak in the filtered_low_real
             extrema = 1 if self.peak_or_trough == 'peak' else -1
             thresh = (filtered_low_real.max() - filtered_low_real.min()) / 10.
-            self.peak_loc, self.peak_mag = peak_finder_multi_epochs(
+            peak_loc, peak_mag = peak_finder_multi_epochs(
                 filtered_low_real, fs=self.fs, t_plot=self.t_plot,
                 mask=self.mask, thresh=thresh, extrema=extrema)
         else:
             # find the peak in the phase of filtered_low
-            phase = np.angle(self.filtered_low_)
+            phase = np.angle(filtered_low)
             if self.peak_or_trough == 'peak':
                 phase = (phase + 2 * np.pi) % (2 * np.pi)
-            self.peak_loc, _ = peak_finder_multi_epochs(
-                phase, fs=self.fs, t_plot=self.t_plot, mask=self.mask,
-                extrema=1)
-            self.peak_mag = filtered_low_real.ravel()[self.peak_loc]
-
-        # extract several signals with band-pass filters
-        # n_high, n_epochs, n_points = filtered_high.shape
-        self.filtered_high_ = multiple_band_pass(
-            self.high_sig, self.fs, self.high_fq_range, self.high_fq_width,
-            n_cycles=None, filter_method=self.filter_method)
-
-        # compute the peak locked time-frequency representation
-        time_frequency_ = peak_locked_time_frequency(
-            self.filtered_high_, self.fs, self.high_fq_range,
-            peak_loc=self.peak_loc, t_plot=self.t_plot, mask=self.mask)
-
-        # compute the peak locked time representation
-        # we don't need the mask here, since only the valid peak locations are
-        # kept in peak_finder_multi_epochs
-        time_average_ = peak_locked_percentile(self.low_sig[None, :], self.fs,
-                                               self.peak_loc, self.t_plot,
-                                               self.percentiles)
-        time_average_ = time_average_[0, :, :]
-
-        self.time_frequency_ = time_frequency_
-        self.time_average_ = time_average_
-
-        return self
+            peak_loc = phase_peak_finder_multi_epochs(
+                phase, fs=self.fs, t_plot=self.t_plot, mask=self.mask)
+            peak_mag = filtered_low_real.ravel()[peak_loc]
+
+        return peak_loc, peak_mag
+
+    def _select_low_fq(self, i_low):
+        """Return filtered_low_, peak_loc, peak_mag, time_frequency_ and
+        time_average_ for the low frequency low_fq[i_low]"""
+        attributes = (self.filtered_low_, self.peak_loc, self.peak_mag,
+                      self.time_frequency_, self.time_average_)
+        if np.ndim(self.low_fq) == 0:
+            return attributes
+        return tuple(attribute[i_low] for attribute in attributes)
+
+    def plot_peaks(self, ax=None, i_low=0):
+        """
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes instance or None
+            Axes where the peaks are plotted. If None, a new figure is
+            created.
 
-    def plot_peaks(self, ax=None):
+        i_low : int
+            Index of the low frequency to plot, if low_fq is a list
+        """
         check_is_fitted(self, 'filtered_low_')
+        filtered_low_, peak_loc, peak_mag, _, _ = self._select_low_fq(i_low)
         # plot the filtered_low_real peaks
         if not isinstance(ax, matplotlib.axes.Axes):
             fig = plt.figure(figsize=(16, 5))
@@ -168,25 +206,30 @@ class PeakLocking(object):
         n_point_plot = min(3000, self.low_sig.shape[1])
         time = np.arange(n_point_plot) / float(self.fs)
 
-        filtered = np.real(self.filtered_low_[0, :n_point_plot])
+        filtered = np.real(filtered_low_[0, :n_point_plot])
 
         ax.plot(time, self.low_sig[0, :n_point_plot], label='signal')
         ax.plot(time, filtered, label='driver')
-        ax.plot(self.peak_loc[self.peak_loc < n_point_plot] / float(self.fs),
-                self.peak_mag[self.peak_loc < n_point_plot], 'o',
-                label='peaks')
+        ax.plot(peak_loc[peak_loc < n_point_plot] / float(self.fs),
+                peak_mag[peak_loc < n_point_plot], 'o', label='peaks')
         ax.set_xlabel('Time (sec)')
         ax.set_title("Driver's peak detection")
-        ax.set_legend(loc=0)
+        ax.legend(loc=0)
 
-    def plot(self, axs=None, vmin=None, vmax=None, ylim=None):
+    def plot(self, axs=None, vmin=None, vmax=None, ylim=None, i_low=0):
         """
+        Parameters
+        ----------
+        i_low : int
+            Index of the low frequency to plot, if low_fq is a list
+
         Returns
         -------
         fig : matplotlib.figure.Figure
             Figure instance containing the plot.
         """
         check_is_fitted(self, 'time_average_')
+        _, _, _, time_frequency_, time_average_ = self._select_low_fq(i_low)
         if axs is None:
             fig, axs = plt.subplots(2, 1, sharex=True, figsize=(8, 8))
             axs = axs.ravel()
@@ -195,15 +238,15 @@ class PeakLocking(object):
 
         # plot the peak-locked time-frequency
         ax = axs[0]
-        n_high, n_points = self.time_average_.shape
-        vmax = np.abs(self.time_frequency_).max() if vmax is None else vmax
+        n_high, n_points = time_average_.shape
+        vmax = np.abs(time_frequency_).max() if vmax is None else vmax
         vmin = -vmax
         extent = (
             -self.t_plot / 2,
             self.t_plot / 2,
             self.high_fq_range[0],
             self.high_fq_range[-1], )
-        cax = ax.imshow(self.time_frequency_, cmap=plt.get_cmap('RdBu_r'),
+        cax = ax.imshow(time_frequency_, cmap=plt.get_cmap('RdBu_r'),
                         vmin=vmin, vmax=vmax, aspect='auto', origin='lower',
                         interpolation='none', extent=extent)
 
@@ -228,11 +271,11 @@ class PeakLocking(object):
         }
         colors = mpl_palette('viridis', n_colors=len(self.percentiles))
 
-        n_percentiles, n_points = self.time_average_.shape
+        n_percentiles, n_points = time_average_.shape
         time = (np.arange(n_points) - n_points // 2) / float(self.fs)
         for i, p in enumerate(self.percentiles):
             label = ('%d %%' % p) if isinstance(p, int) else labels[p]
-            ax.plot(time, self.time_average_[i, :], color=colors[i],
+            ax.plot(time, time_average_[i, :], color=colors[i],
                     label=label)
 
         ax.set_xlabel('Time (sec)')
@@ -258,79 +301,162 @@ def peak_finder_multi_epochs(x0, fs=None, t_plot=None, mask=None, thresh=None,
     """
     n_epochs, n_points = x0.shape
 
+    epochs_list = []
     peak_inds_list = []
     peak_mags_list = []
     for i_epoch in range(n_epochs):
         peak_inds, peak_mags = peak_finder(x0[i_epoch], thresh=thresh,
                                            extrema=extrema)
+        peak_inds = np.atleast_1d(peak_inds).astype(np.intp)
+        epochs_list.append(np.full(peak_inds.size, i_epoch, dtype=np.intp))
+        peak_inds_list.append(peak_inds)
+        peak_mags_list.append(np.atleast_1d(peak_mags))
+
+    selection = _select_peaks(np.concatenate(epochs_list),
+                              np.concatenate(peak_inds_list), n_points,
+                              fs=fs, t_plot=t_plot, mask=mask,
+                              extrema=extrema)
+    return selection[0], np.concatenate(peak_mags_list)[selection[1]]
+
+
+def phase_peak_finder_multi_epochs(phase, fs=None, t_plot=None, mask=None):
+    """Find the peaks of a phase signal, i.e. the points where it wraps
+    around 2 * pi, for multiple epochs at once.
+
+    The peaks are the last samples before the phase decreases by more than
+    pi. As in peak_finder_multi_epochs, the indices are given in the
+    ravelled array, and the peaks too close to the start or the end of each
+    epoch, or masked by the mask, are removed.
+
+    Parameters
+    ----------
+    phase : array, shape (n_epochs, n_points)
+        Phase signal, in radians
+
+    fs : float or None
+        Sampling frequency
+
+    t_plot : float or None
+        Time window around the peaks (in second)
+
+    mask : array or None, shape (n_epochs, n_points)
+        The peaks are only kept where the mask is False.
+
+    Returns
+    -------
+    peak_loc : array, shape (n_peaks, )
+        Indices of the peaks in the ravelled array
+    """
+    n_epochs, n_points = phase.shape
+    wraps = np.diff(phase, axis=1) < -np.pi
+    epochs, peak_inds = np.nonzero(wraps)
+
+    peak_loc, _ = _select_peaks(epochs, peak_inds, n_points, fs=fs,
+                                t_plot=t_plot, mask=mask, extrema=1)
+    return peak_loc
 
-        # remove the peaks too close to the start or the end
-        if t_plot is not None and fs is not None:
-            n_half_window = int(fs * t_plot / 2.)
-            selection = np.logical_and(peak_inds > n_half_window,
-                                       peak_inds < n_points - n_half_window)
-            peak_inds = peak_inds[selection]
-            peak_mags = peak_mags[selection]
 
-        # remove the masked peaks
-        if mask is not None:
-            selection = mask[i_epoch, peak_inds] == 0
-            peak_inds = peak_inds[selection]
-            peak_mags = peak_mags[selection]
+def _select_peaks(epochs, peak_inds, n_points, fs=None, t_plot=None,
+                  mask=None, extrema=1):
+    """Remove the peaks too close to the start or the end of each epoch, and
+    the masked peaks. Return the indices of the kept peaks in the ravelled
+    array, and the boolean selection over the input peaks."""
+    selection = np.ones(peak_inds.size, dtype=bool)
 
-        peak_inds_list.extend(peak_inds + i_epoch * n_points)
-        peak_mags_list.extend(peak_mags)
+    # remove the peaks too close to the start or the end
+    if t_plot is not None and fs is not None:
+        n_half_window = int(fs * t_plot / 2.)
+        selection &= peak_inds > n_half_window
+        selection &= peak_inds < n_points - n_half_window
+
+    # remove the masked peaks
+    if mask is not None:
+        selection &= mask[epochs, peak_inds] == 0
 
-    if peak_inds_list == []:
+    if not np.any(selection):
         raise ValueError("No %s detected. The signal might be to short, "
                          "or the mask to strong. You can also try to reduce "
                          "the plotted time window `t_plot`." %
                          ["trough", "peak"][(extrema + 1) // 2])
 
-    return np.array(peak_inds_list), np.array(peak_mags_list)
+    peak_loc = peak_inds[selection] + epochs[selection] * n_points
+    return peak_loc, selection
 
 
 def peak_locked_time_frequency(filtered_high, fs, high_fq_range, peak_loc,
                                t_plot, mask=None):
     """
     Compute the peak-locked Time-frequency
+
+    The input filtered_high is not modified.
     """
-    # normalize each signal independently
-    n_high, n_epochs, n_points = filtered_high.shape
+    return _peak_locked_time_frequency(filtered_high, fs, [peak_loc], t_plot,
+                                       mask=mask)[0]
 
-    # normalization is done everywhere, but mean is computed
-    #  only where mask == 1
-    if mask is not None:
-        masked_filtered_high = filtered_high[:, mask == 0]
-    else:
-        masked_filtered_high = filtered_high.reshape(n_high, -1)
 
-    mean = masked_filtered_high.mean(axis=1)[:, None, None]
-    std = masked_filtered_high.std(axis=1)[:, None, None]
+def _peak_locked_time_frequency(filtered_high, fs, peak_loc_list, t_plot,
+                                mask=None):
+    """
+    Compute the peak-locked Time-frequency for several lists of peaks
 
-    filtered_high -= mean
-    filtered_high /= std
+    The high frequency bands are processed one at a time, so that only the
+    power of one band is stored in memory.
 
-    # get the power (np.abs(filtered_high) ** 2)
-    filtered_high *= np.conj(filtered_high)
-    filtered_high = np.real(filtered_high)
+    Returns
+    -------
+    evoked_signals : array, shape (n_peak_loc, n_high, n_window)
+    """
+    n_high, n_epochs, n_points = filtered_high.shape
+    n_window = int(fs * t_plot / 2.) * 2 + 1
 
-    # subtract the mean power.
-    if mask is not None:
-        masked_filtered_high = filtered_high[:, mask == 0]
-    else:
-        masked_filtered_high = filtered_high.reshape(n_high, -1)
-    mean = masked_filtered_high.mean(axis=1)[:, None, None]
-    filtered_high -= mean
+    evoked_signals = np.zeros((len(peak_loc_list), n_high, n_window))
+    for i_high in range(n_high):
+        power = normalized_power(filtered_high[i_high], mask=mask)
 
-    # compute the evoked signals (peak-locked mean)
-    evoked_signals = peak_locked_percentile(filtered_high, fs, peak_loc,
-                                            t_plot)
-    evoked_signals = evoked_signals[:, 0, :]
+        # compute the evoked signals (peak-locked mean)
+        for i_loc, peak_loc in enumerate(peak_loc_list):
+            evoked_signals[i_loc, i_high] = peak_locked_percentile(
+                power[None], fs, peak_loc, t_plot)[0, 0]
 
     return evoked_signals
 
 
+def normalized_power(filtered, mask=None):
+    """
+    Compute the power of one filtered signal, after normalizing it, and
+    subtract its mean power.
+
+    Parameters
+    ----------
+    filtered : array, shape (n_epochs, n_points)
+        Filtered signal (amplitude signal). It is not modified.
+
+    mask : array or None, shape (n_epochs, n_points)
+        The mean and standard deviation are only computed where the mask is
+        False, but the normalization is applied everywhere.
+
+    Returns
+    -------
+    power : array, shape (n_epochs, n_points)
+        Normalized power, with zero mean
+    """
+    valid = None if mask is None else mask == 0
+    mean = (filtered if valid is None else filtered[valid]).mean()
+
+    # get the power of the centered signal (np.abs(filtered - mean) ** 2)
+    centered = filtered - mean
+    power = np.real(centered) ** 2
+    if np.iscomplexobj(centered):
+        power += np.imag(centered) ** 2
+    del centered
+
+    # normalize by the variance, and subtract the mean power
+    power /= (power if valid is None else power[valid]).mean()
+    power -= (power if valid is None else power[valid]).mean()
+
+    return power
+
+
 def peak_locked_percentile(signals, fs, peak_loc, t_plot,
                            percentiles=['mean']):
     """
@@ -353,9 +479,19 @@ def peak_locked_percentile(signals, fs, peak_loc, t_plot,
     n_window = int(fs * t_plot / 2.) * 2 + 1
     n_percentiles = len(percentiles)
 
+    # separate the integer percentiles from the statistics on mean and std
+    int_percentiles = [i_p for i_p, p in enumerate(percentiles)
+                       if isinstance(p, int)]
+    valid_strings = ('mean', 'std+', 'std-', 'ste+', 'ste-')
+    for p in percentiles:
+        if not isinstance(p, int) and p not in valid_strings:
+            raise ValueError('wrong percentile string: %s' % p)
+    need_std = any(not isinstance(p, int) and p != 'mean'
+                   for p in percentiles)
+
     # build indices matrix: each line is a index range around peak locations
-    indices = np.tile(peak_loc, (n_window, 1)).T
-    indices = indices + np.arange(n_window) - n_window // 2
+    indices = (np.asarray(peak_loc)[:, None] + np.arange(n_window) -
+               n_window // 2)
 
     # ravel the epochs since we now have isolated events
     signals = signals.reshape(n_signals, -1)
@@ -366,26 +502,34 @@ def peak_locked_percentile(signals, fs, peak_loc, t_plot,
     # compute the evoked signals (peak-locked mean)
     evoked_signals = np.zeros((n_signals, n_percentiles, n_window))
     for i_s in range(n_signals):
-        for i_p, p in enumerate(percentiles):
-            if isinstance(p, int):
-                evoked_signals[i_s, i_p] = np.percentile(signals[i_s][indices],
-                                                         p, axis=0)
-                continue
+        # gather the windows only once, for all the statistics
+        windows = signals[i_s][indices]
+
+        if int_percentiles:
+            evoked_signals[i_s, int_percentiles] = np.percentile(
+                windows, [percentiles[i_p] for i_p in int_percentiles],
+                axis=0)
+        if len(int_percentiles) == n_percentiles:
+            continue
+
+        # mean and std, reusing the gathered windows in place
+        mean = windows.sum(axis=0) / n_peaks
+        if need_std:
+            # center inplace before squaring, for a numerically stable std
+            windows -= mean
+            windows *= windows
+            std = np.sqrt(windows.sum(axis=0) / n_peaks)
 
-            mean = np.mean(signals[i_s][indices], axis=0)
+        for i_p, p in enumerate(percentiles):
             if p == 'mean':
                 evoked_signals[i_s, i_p] = mean
-            else:
-                std = np.std(signals[i_s][indices], axis=0)
-                if p == 'std+':
-                    evoked_signals[i_s, i_p] = mean + std
-                elif p == 'std-':
-                    evoked_signals[i_s, i_p] = mean - std
-                elif p == 'ste+':
-                    evoked_signals[i_s, i_p] = mean + std / np.sqrt(n_peaks)
-                elif p == 'ste-':
-                    evoked_signals[i_s, i_p] = mean - std / np.sqrt(n_peaks)
-                else:
-                    raise (ValueError, 'wrong percentile string: %s' % p)
+            elif p == 'std+':
+                evoked_signals[i_s, i_p] = mean + std
+            elif p == 'std-':
+                evoked_signals[i_s, i_p] = mean - std
+            elif p == 'ste+':
+                evoked_signals[i_s, i_p] = mean + std / np.sqrt(n_peaks)
+            elif p == 'ste-':
+                evoked_signals[i_s, i_p] = mean - std / np.sqrt(n_peaks)
 
     return evoked_signals
@@ -9,6 +9,7 @@ from pactools.utils.testing import assert_raises, assert_array_equal
 from pactools.utils.testing import assert_true, assert_array_almost_equal
 from pactools.comodulogram import Comodulogram
 from pactools.comodulogram import ALL_PAC_METRICS, BICOHERENCE_PAC_METRICS
+from pactools.comodulogram import _interpolate
 from pactools.simulate_pac import simulate_pac
 
 # Parameters used for the simulated signal in the test
@@ -168,6 +169,26 @@ def test_comodulogram_dar_models():
         assert_true(~np.any(np.isnan(comod)))
 
 
+def test_interpolate():
+    # Test the linear interpolation against np.interp
+    rng = np.random.RandomState(0)
+    x1, y1 = np.arange(4.), np.linspace(0, 10, 11)
+    z1 = rng.randn(4, 11)
+    x2, y2 = np.array([-1., 0.5, 2.25, 3.]), np.array([0.3, 4.5, 10., 11.])
+    z2 = _interpolate(x1, y1, z1, x2, y2)
+    assert_equal(z2.shape, (4, 4))
+
+    # in 2d, extrapolation with the nearest value
+    z2_ref = np.array([[np.interp(y, y1, z) for z in z1] for y in y2])
+    z2_ref = np.array([[np.interp(x, x1, z) for x in x2] for z in z2_ref])
+    assert_array_almost_equal(z2, z2_ref)
+
+    # in 1d, NaN outside of the grid
+    z2 = _interpolate(x1[:1], y1, z1[:1], x2[:1], y2)
+    assert_array_almost_equal(z2[:3, 0], np.interp(y2[:3], y1, z1[0]))
+    assert_true(np.isnan(z2[3, 0]))
+
+
 def test_plot_comodulogram():
     # Smoke test with the standard plotting function
     est = ComodTest().fit(signal)
@@ -3,8 +3,9 @@ import matplotlib.pyplot as plt
 
 from pactools.utils.testing import assert_equal, assert_array_almost_equal
 from pactools.utils.testing import assert_raises, assert_greater
-from pactools.delay_estimator import DelayEstimator
-from pactools.dar_model import DAR
+from pactools.utils.testing import assert_true
+from pactools.delay_estimator import DelayEstimator, _fit_delays
+from pactools.dar_model import DAR, HAR, extract_driver
 from pactools.simulate_pac import simulate_pac
 
 # Parameters used for the simulated signal in the test
@@ -59,3 +60,61 @@ def test_plot_delay_estimation():
     est = fast_delay()
     est.plot()
     plt.close('all')
+
+
+def test_delay_search():
+    # Test that the coarse-to-fine search evaluates a subset of the grid,
+    # with the same values as the exhaustive search
+    max_delay = 0.1 / low_fq
+    est_0 = DelayEstimator(fs=fs, dar_model=DAR(ordar=10, ordriv=2),
+                           low_fq=low_fq, low_fq_width=low_fq_width,
+                           random_state=0, max_delay=max_delay).fit(signal)
+    est_1 = DelayEstimator(fs=fs, dar_model=DAR(ordar=10, ordriv=2),
+                           low_fq=low_fq, low_fq_width=low_fq_width,
+                           random_state=0, max_delay=max_delay,
+                           search='coarse_to_fine').fit(signal)
+    assert_array_almost_equal(est_0.evaluated_delays_ms_, est_0.delays_ms_)
+    assert_greater(est_1.delays_ms_.size, est_1.evaluated_delays_ms_.size)
+
+    evaluated = ~np.isnan(est_1.neg_log_likelihood_)
+    assert_array_almost_equal(est_1.delays_ms_[evaluated],
+                              est_1.evaluated_delays_ms_)
+    assert_array_almost_equal(est_1.neg_log_likelihood_[evaluated],
+                              est_0.neg_log_likelihood_[evaluated])
+    assert_true(est_1.best_delay_ms_ in est_1.evaluated_delays_ms_)
+
+    assert_raises(ValueError, fast_delay, search='foo')
+
+
+def test_delay_fit_shortcut():
+    # Test that the reuse of the basis and of the regression moments gives
+    # the same likelihood as a full fit for each delay
+    sigdriv, sigin, sigdriv_imag = extract_driver(
+        signal[None, :], fs, low_fq, bandwidth=low_fq_width, fill=2,
+        random_state=0)
+    delays_point = np.arange(-3, 4)
+    for dar_model in (DAR(ordar=10, ordriv=2), HAR(ordar=10, ordriv=2)):
+        neg_log_likelihood = _fit_delays(dar_model, fs, delays_point, sigin,
+                                         sigdriv, sigdriv_imag, None)
+        for delay, value in zip(delays_point, neg_log_likelihood):
+            sigdriv_ = np.roll(sigdriv, delay, axis=1)
+            sigdriv_imag_ = np.roll(sigdriv_imag, delay, axis=1)
+            dar_model.fit(sigin=sigin, sigdriv=sigdriv_,
+                          sigdriv_imag=sigdriv_imag_, fs=fs)
+            expected = dar_model.get_criterion('-logl')
+            dar_model.fit(sigin=sigin[:, ::-1], sigdriv=sigdriv_[:, ::-1],
+                          sigdriv_imag=sigdriv_imag_[:, ::-1], fs=fs)
+            expected += dar_model.get_criterion('-logl')
+            assert_array_almost_equal(value, expected)
+
+
+def test_delay_n_jobs():
+    # Test that the parallel scan gives the same results
+    mask = np.zeros(n_points, dtype=bool)
+    mask[:n_points // 4] = True
+    est_0 = fast_delay(mask=mask)
+    for n_jobs in (2, -1):
+        est_1 = fast_delay(mask=mask, n_jobs=n_jobs)
+        assert_array_almost_equal(est_1.neg_log_likelihood_,
+                                  est_0.neg_log_likelihood_)
+        assert_equal(est_1.best_delay_ms_, est_0.best_delay_ms_)
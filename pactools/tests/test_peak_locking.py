@@ -2,8 +2,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from pactools.utils.testing import assert_equal, assert_array_almost_equal
-from pactools.utils.testing import assert_raises
-from pactools.peak_locking import PeakLocking
+from pactools.utils.testing import assert_raises, assert_true
+from pactools.utils.testing import assert_array_equal
+from pactools.peak_locking import PeakLocking, peak_locked_percentile
+from pactools.peak_locking import peak_finder_multi_epochs
+from pactools.peak_locking import phase_peak_finder_multi_epochs
+from pactools.peak_locking import peak_locked_time_frequency
+from pactools.peak_locking import normalized_power
 from pactools.simulate_pac import simulate_pac
 
 # Parameters used for the simulated signal in the test
@@ -38,6 +43,25 @@ def test_peak_locking_shape():
     assert_equal(n_window, n_window_2)
 
 
+def test_multiple_low_fq():
+    # Test that a list of low_fq gives the same results as separate fits
+    low_fqs = [2., 3., 4.]
+    kwargs = dict(high_fq_range=high_fq_range, high_fq_width=6.,
+                  percentiles=[25, 'mean'])
+    plkg = fast_peak_locking(low_fq=low_fqs, **kwargs)
+    n_low = len(low_fqs)
+    assert_equal(plkg.time_frequency_.shape[:2], (n_low, n_high))
+    assert_equal(plkg.time_average_.shape[:2], (n_low, 2))
+
+    for i_low, this_low_fq in enumerate(low_fqs):
+        plkg_single = fast_peak_locking(low_fq=this_low_fq, **kwargs)
+        assert_array_almost_equal(plkg.time_frequency_[i_low],
+                                  plkg_single.time_frequency_)
+        assert_array_almost_equal(plkg.time_average_[i_low],
+                                  plkg_single.time_average_)
+        assert_array_equal(plkg.peak_loc[i_low], plkg_single.peak_loc)
+
+
 def test_different_dimension_in_input():
     # Test that 1D or 2D signals are accepted, but not 3D
     for dim in [(4, -1), (-1, ), (1, -1)]:
@@ -57,6 +81,91 @@ def test_empty_mask():
     assert_array_almost_equal(plkg_0.time_average_, plkg_1.time_average_)
 
 
+def test_peak_locked_percentile():
+    # Test the statistics against a direct computation on the windows
+    rng = np.random.RandomState(0)
+    signals = rng.randn(3, 2, 100)
+    peak_loc = np.array([10, 30, 50, 130, 170])
+    percentiles = [5, 'mean', 'std+', 50, 'ste-']
+    evoked = peak_locked_percentile(signals, 10., peak_loc, 1.,
+                                    percentiles=percentiles)
+    assert_equal(evoked.shape, (3, 5, 11))
+
+    for i_s in range(3):
+        windows = np.array([signals[i_s].ravel()[i - 5:i + 6]
+                            for i in peak_loc])
+        mean = windows.mean(axis=0)
+        std = windows.std(axis=0)
+        expected = [np.percentile(windows, 5, axis=0), mean, mean + std,
+                    np.median(windows, axis=0), mean - std / np.sqrt(5)]
+        assert_array_almost_equal(evoked[i_s], expected)
+
+    # the std is not affected by a large offset
+    evoked = peak_locked_percentile(signals + 1e8, 10., peak_loc, 1.,
+                                    percentiles=['mean', 'std+'])
+    for i_s in range(3):
+        windows = np.array([signals[i_s].ravel()[i - 5:i + 6]
+                            for i in peak_loc])
+        assert_array_almost_equal(evoked[i_s, 1] - evoked[i_s, 0],
+                                  windows.std(axis=0), decimal=6)
+
+    assert_raises(ValueError, peak_locked_percentile, signals, 10., peak_loc,
+                  1., percentiles=['foo'])
+
+
+def test_phase_peak_finder():
+    # Test the vectorized detector against peak_finder on a clean phase
+    n_epochs, n_points_ = 3, 1000
+    time = np.arange(n_points_) / fs
+    phase = 2 * np.pi * low_fq * time[None, :] + np.arange(n_epochs)[:, None]
+    phase = phase % (2 * np.pi)
+    mask = np.zeros(phase.shape, dtype=bool)
+    mask[1, 300:600] = True
+
+    for this_mask in [None, mask]:
+        peak_loc = phase_peak_finder_multi_epochs(phase, fs=fs, t_plot=1.,
+                                                  mask=this_mask)
+        peak_loc_ref, _ = peak_finder_multi_epochs(phase, fs=fs, t_plot=1.,
+                                                   mask=this_mask)
+        assert_array_equal(peak_loc, peak_loc_ref)
+
+    # the peaks too close to the edges or masked are removed
+    epochs, peak_inds = np.divmod(peak_loc, n_points_)
+    n_half_window = int(fs / 2.)
+    assert_true(np.all(peak_inds > n_half_window))
+    assert_true(np.all(peak_inds < n_points_ - n_half_window))
+    assert_true(not np.any(mask[epochs, peak_inds]))
+
+    assert_raises(ValueError, phase_peak_finder_multi_epochs, phase, fs=fs,
+                  t_plot=1., mask=np.ones(phase.shape, dtype=bool))
+
+
+def test_peak_locked_time_frequency():
+    # Test that the input is not modified, and the normalization
+    rng = np.random.RandomState(0)
+    filtered_high = (rng.randn(3, 2, 200) + 1j * rng.randn(3, 2, 200) +
+                     np.arange(3)[:, None, None])
+    filtered_high_copy = filtered_high.copy()
+    mask = rng.rand(2, 200) > 0.6
+    peak_loc = np.array([20, 150, 260, 380])
+
+    evoked = peak_locked_time_frequency(filtered_high, fs, high_fq_range,
+                                        peak_loc, 0.1, mask=mask)
+    assert_array_equal(filtered_high, filtered_high_copy)
+    assert_equal(evoked.shape, (3, 21))
+
+    for i_high in range(3):
+        valid = filtered_high[i_high][~mask]
+        power = np.abs((filtered_high[i_high] - valid.mean()) /
+                       valid.std()) ** 2
+        power -= power[~mask].mean()
+        assert_array_almost_equal(
+            normalized_power(filtered_high[i_high], mask=mask), power)
+        expected = np.mean([power.ravel()[i - 10:i + 11] for i in peak_loc],
+                           axis=0)
+        assert_array_almost_equal(evoked[i_high], expected)
+
+
 def test_plot_peaklocking():
     # Smoke test with the standard plotting function
     est = PeakLocking(fs=fs, low_fq=low_fq).fit(signal)
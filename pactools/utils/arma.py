@@ -76,18 +76,20 @@ def ai2ki(ar):
     """Convert AR coefficients to partial correlations
     (inverse Levinson recurrence)
 
-    ar : AR models stored by columns
+    ar : AR models stored by columns, shape (ordar, ...)
 
     returns the partial correlations (one model by column)
 
     """
-    parcor = np.copy(ar)
-    ordar, n_epochs, n_points = ar.shape
-    for i in range(ordar - 1, -1, -1):
-        if i > 0:
-            parcor[0:i, :, :] -= (parcor[i:i + 1, :, :] *
-                                  np.flipud(parcor[0:i, :, :]))
-            parcor[0:i, :, :] *= 1.0 / (1.0 - parcor[i:i + 1, :, :] ** 2)
+    parcor = np.array(ar, dtype=float)
+    ordar = parcor.shape[0]
+    # buffer to avoid the allocation of temporary arrays in the loop
+    tmp = np.empty_like(parcor)
+    for i in range(ordar - 1, 0, -1):
+        # parcor[j] -= parcor[i] * parcor[i - 1 - j], for j < i
+        np.multiply(parcor[i], parcor[i - 1::-1], out=tmp[:i])
+        parcor[:i] -= tmp[:i]
+        parcor[:i] /= 1.0 - parcor[i] ** 2
     return parcor
 
 
@@ -95,17 +97,22 @@ def ki2ai(parcor):
     """Convert parcor coefficients to autoregressive ones
     (Levinson recurrence)
 
-    parcor : partial correlations stored by columns
+    parcor : partial correlations stored by columns, shape (ordar, ...)
 
     returns the AR models by columns
 
     """
-    ar = np.zeros_like(parcor)
-    ordar, n_epochs, n_points = parcor.shape
+    parcor = np.asarray(parcor, dtype=float)
+    ar = np.empty_like(parcor)
+    ordar = parcor.shape[0]
+    # buffer to avoid the allocation of temporary arrays in the loop
+    tmp = np.empty_like(parcor)
     for i in range(ordar):
         if i > 0:
-            ar[0:i, :, :] += parcor[i:i + 1, :, :] * np.flipud(ar[0:i, :, :])
-        ar[i, :, :] = parcor[i, :, :]
+            # ar[j] += parcor[i] * ar[i - 1 - j], for j < i
+            np.multiply(parcor[i], ar[i - 1::-1], out=tmp[:i])
+            ar[:i] += tmp[:i]
+        ar[i] = parcor[i]
 
     # ok, at least in stationary models
     return ar
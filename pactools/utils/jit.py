@@ -0,0 +1,18 @@
+def _fake_njit(*args, **kwargs):
+    """Useless decorator that is used like numba.njit"""
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+
+    def decorator(func):
+        return func
+
+    return decorator
+
+
+# try to import from numba, otherwise, create a dummy decorator with no effect
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    njit = _fake_njit
+    HAS_NUMBA = False
@@ -96,3 +96,92 @@ def prime_factors(num):
     if num != 1:
         decomposition.append(num)
     return decomposition
+
+
+def circular_slices(n_points, shift):
+    """Split a circular shift into contiguous segments
+
+    Parameters
+    ----------
+    n_points : int
+        Length of the shifted axis
+
+    shift : int
+        Number of places by which elements are shifted, as in np.roll
+
+    Returns
+    -------
+    segments : list of tuple of slices
+        Pairs (dst, src) such that np.roll(x, shift)[dst] == x[src], which
+        together cover the whole axis
+    """
+    shift = shift % n_points if n_points > 0 else 0
+    if shift == 0:
+        return [(slice(None), slice(None))]
+    return [(slice(shift, None), slice(None, n_points - shift)),
+            (slice(None, shift), slice(n_points - shift, None))]
+
+
+def roll(x, shift, axis=None, out=None):
+    """Same as np.roll, but possibly in a preallocated array
+
+    As in np.roll, the array is flattened if axis is None, and the result is
+    reshaped to the original shape.
+
+    Parameters
+    ----------
+    x : array
+        Input array
+
+    shift : int
+        Number of places by which elements are shifted
+
+    axis : int or None
+        Axis along which elements are shifted
+
+    out : None or array, same shape as x
+        Preallocated C-contiguous array in which the result is written, to
+        avoid an allocation when shifting several times. It can not be x.
+
+    Returns
+    -------
+    out : array, same shape as x
+        Shifted array
+    """
+    x = np.asarray(x)
+    if out is None:
+        out = np.empty(x.shape, dtype=x.dtype)
+    elif not out.flags.c_contiguous:
+        raise ValueError('out should be C-contiguous.')
+
+    if axis is None:
+        x_flat, out_flat = x.reshape(-1), out.reshape(-1)
+        for dst, src in circular_slices(x.size, shift):
+            out_flat[dst] = x_flat[src]
+    else:
+        index_dst = [slice(None)] * x.ndim
+        index_src = [slice(None)] * x.ndim
+        for dst, src in circular_slices(x.shape[axis], shift):
+            index_dst[axis], index_src[axis] = dst, src
+            out[tuple(index_dst)] = x[tuple(index_src)]
+    return out
+
+
+def circular_dot(a, b, shift):
+    """Compute np.dot(a, np.roll(b, shift)) without shifting b
+
+    Parameters
+    ----------
+    a, b : arrays, shape (n_points, )
+        Input vectors
+
+    shift : int
+        Number of places by which elements of b are shifted
+
+    Returns
+    -------
+    dot : float or complex
+        Inner product of a and the shifted b
+    """
+    return sum(np.dot(a[dst], b[src])
+               for dst, src in circular_slices(a.shape[0], shift))
@@ -20,12 +20,18 @@ def _fake_delayed(func):
     return func
 
 
+def _fake_effective_n_jobs(n_jobs=1):
+    return 1
+
+
 # try to import from joblib, otherwise, create a dummy function with no effect
 try:
-    from joblib import Parallel, delayed
+    from joblib import Parallel, delayed, effective_n_jobs
 except ImportError:
     try:
         from sklearn.externals.joblib import Parallel, delayed
+        from sklearn.externals.joblib import effective_n_jobs
     except ImportError:
         Parallel = _FakeParallel
         delayed = _fake_delayed
+        effective_n_jobs = _fake_effective_n_jobs
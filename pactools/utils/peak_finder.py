@@ -1,6 +1,8 @@
 import numpy as np
 from math import ceil
 
+from .jit import njit
+
 
 # copy from MNE-python
 def peak_finder(x0, thresh=None, extrema=1):
@@ -63,11 +65,6 @@ def peak_finder(x0, thresh=None, extrema=1):
 
     if length > 2:  # Function with peaks and valleys
 
-        # Set initial parameters for loop
-        temp_mag = min_mag
-        found_peak = False
-        left_min = min_mag
-
         # Deal with first point a little differently since tacked it on
         # Calculate the sign of the derivative since we taked the first point
         # on it does not necessarily alternate like the rest.
@@ -88,50 +85,11 @@ def peak_finder(x0, thresh=None, extrema=1):
 
         # Preallocate max number of maxima
         maxPeaks = int(ceil(length / 2.0))
-        peak_loc = np.zeros(maxPeaks, dtype=np.int)
+        peak_loc = np.zeros(maxPeaks, dtype=np.intp)
         peak_mag = np.zeros(maxPeaks)
-        c_ind = 0
-        # Loop through extrema which should be peaks and then valleys
-        while ii < (length - 1):
-            ii += 1  # This is a peak
-            # Reset peak finding if we had a peak and the next peak is bigger
-            # than the last or the left min was small enough to reset.
-            if found_peak and ((x[ii] > peak_mag[-1]) or
-                               (left_min < peak_mag[-1] - thresh)):
-                temp_mag = min_mag
-                found_peak = False
-
-            # Make sure we don't iterate past the length of our vector
-            if ii == length - 1:
-                break  # We assign the last point differently out of the loop
-
-            # Found new peak that was lager than temp mag and threshold larger
-            # than the minimum to its left.
-            if (x[ii] > temp_mag) and (x[ii] > left_min + thresh):
-                temp_loc = ii
-                temp_mag = x[ii]
-
-            ii += 1  # Move onto the valley
-            # Come down at least thresh from peak
-            if not found_peak and (temp_mag > (thresh + x[ii])):
-                found_peak = True  # We have found a peak
-                left_min = x[ii]
-                peak_loc[c_ind] = temp_loc  # Add peak to index
-                peak_mag[c_ind] = temp_mag
-                c_ind += 1
-            elif x[ii] < left_min:  # New left minima
-                left_min = x[ii]
-
-        # Check end point
-        if (x[-1] > temp_mag) and (x[-1] > (left_min + thresh)):
-            peak_loc[c_ind] = length - 1
-            peak_mag[c_ind] = x[-1]
-            c_ind += 1
-        elif not found_peak and temp_mag > min_mag:
-            # Check if we still need to add the last point
-            peak_loc[c_ind] = temp_loc
-            peak_mag[c_ind] = temp_mag
-            c_ind += 1
+        c_ind = _peak_finder_loop(np.asarray(x, dtype=np.float64),
+                                  float(thresh), float(min_mag), ii,
+                                  peak_loc, peak_mag)
 
         # Create output
         peak_inds = ind[peak_loc[:c_ind]]
@@ -151,3 +109,58 @@ def peak_finder(x0, thresh=None, extrema=1):
         x0 = -x0
 
     return peak_inds, peak_mags
+
+
+@njit(cache=True)
+def _peak_finder_loop(x, thresh, min_mag, ii, peak_loc, peak_mag):
+    """Loop over alternating peaks and valleys of peak_finder, filling
+    peak_loc and peak_mag, and returning the number of peaks found.
+    It is compiled with numba when it is installed."""
+    length = x.size
+    temp_mag = min_mag
+    temp_loc = 0
+    found_peak = False
+    left_min = min_mag
+    c_ind = 0
+    # Loop through extrema which should be peaks and then valleys
+    while ii < (length - 1):
+        ii += 1  # This is a peak
+        # Reset peak finding if we had a peak and the next peak is bigger
+        # than the last or the left min was small enough to reset.
+        if found_peak and ((x[ii] > peak_mag[-1]) or
+                           (left_min < peak_mag[-1] - thresh)):
+            temp_mag = min_mag
+            found_peak = False
+
+        # Make sure we don't iterate past the length of our vector
+        if ii == length - 1:
+            break  # We assign the last point differently out of the loop
+
+        # Found new peak that was lager than temp mag and threshold larger
+        # than the minimum to its left.
+        if (x[ii] > temp_mag) and (x[ii] > left_min + thresh):
+            temp_loc = ii
+            temp_mag = x[ii]
+
+        ii += 1  # Move onto the valley
+        # Come down at least thresh from peak
+        if not found_peak and (temp_mag > (thresh + x[ii])):
+            found_peak = True  # We have found a peak
+            left_min = x[ii]
+            peak_loc[c_ind] = temp_loc  # Add peak to index
+            peak_mag[c_ind] = temp_mag
+            c_ind += 1
+        elif x[ii] < left_min:  # New left minima
+            left_min = x[ii]
+
+    # Check end point
+    if (x[length - 1] > temp_mag) and (x[length - 1] > (left_min + thresh)):
+        peak_loc[c_ind] = length - 1
+        peak_mag[c_ind] = x[length - 1]
+        c_ind += 1
+    elif not found_peak and temp_mag > min_mag:
+        # Check if we still need to add the last point
+        peak_loc[c_ind] = temp_loc
+        peak_mag[c_ind] = temp_mag
+        c_ind += 1
+    return c_ind
@@ -1,13 +1,19 @@
 import numpy as np
-import scipy as sp
-from scipy.linalg import hankel
 from scipy.signal import hilbert
 import matplotlib.pyplot as plt
 
 from .maths import square, is_power2, prime_factors, compute_n_fft, next_power2
+from .maths import roll
 from .viz import compute_vmin_vmax
 
 
+# maximum number of elements in the arrays of triple products, in Bicoherence
+BICOHERENCE_CHUNK_SIZE = 2 ** 20
+
+# maximum number of elements in the analytic signals, in phase_amplitude
+PHASE_AMPLITUDE_CHUNK_SIZE = 2 ** 22
+
+
 class Spectrum(object):
     """Spectral estimator following Welch's method
 
@@ -102,32 +108,18 @@ class Spectrum(object):
         block_length = min(self.block_length, n_points)
 
         window = self.wfunc(block_length)
-        n_epochs, tmax = signals.shape
-        n_freq = fft_length // 2 + 1
 
-        psd = np.zeros((n_epochs, n_freq))
-
-        for i, sig in enumerate(signals):
-            block = np.arange(block_length)
-
-            # iterate on blocks
-            count = 0
-            while block[-1] < sig.size:
-                psd[i] += np.abs(
-                    sp.fft(window * sig[block], fft_length, 0))[:n_freq] ** 2
-                count = count + 1
-                block = block + step
-            if count == 0:
-                raise IndexError(
-                    'spectrum: first block has %d samples but sig has %d '
-                    'samples' % (block[-1] + 1, sig.size))
-
-            # normalize
-            if self.donorm:
-                scale = 1.0 / (count * (np.sum(window) ** 2))
-            else:
-                scale = 1.0 / count
-            psd[i] *= scale
+        # power of all blocks of all epochs, with one batched FFT
+        spectra = block_spectra(signals, window, fft_length, step)
+        count = spectra.shape[1]
+        psd = square(spectra).sum(axis=1)
+
+        # normalize
+        if self.donorm:
+            scale = 1.0 / (count * (np.sum(window) ** 2))
+        else:
+            scale = 1.0 / count
+        psd *= scale
 
         if not hold:
             self.psd = []
@@ -264,7 +256,8 @@ class Coherence(Spectrum):
     def fit(self, sigs_a, sigs_b):
         """
         Computes the coherence for two signals.
-        It is symmetrical, and slightly faster if n_signals_a < n_signals_b.
+        It is symmetrical. The spectrum of each block of each signal is
+        computed only once.
 
         Parameters
         ----------
@@ -280,56 +273,101 @@ class Coherence(Spectrum):
             Complex coherence of sigs_a and sigs_b over all epochs.
             n_freqs = fft_length // 2 + 1
         """
-        fft_length, step = self.check_params()
+        self._check_shapes(sigs_a, sigs_b)
+        spectra_b, norm_b = self._spectra(sigs_b, conjugate=True)
+        self.coherence = self._cross_coherence(sigs_a, spectra_b, norm_b)
+        return self.coherence
 
-        n_signals_a, n_epochs, n_points = sigs_a.shape
-        n_signals_b, n_epochs, n_points = sigs_b.shape
-        if sigs_a.shape[1:] != sigs_b.shape[1:]:
-            raise ValueError('Incompatible shapes: %s and %s' %
-                             (sigs_a.shape[1:], sigs_b.shape[1:]))
+    def fit_shifts(self, sigs_a, sigs_b, shifts):
+        """
+        Computes the coherence between sigs_b and several rolled versions
+        of sigs_a, for instance to compute surrogates.
+        The spectra of sigs_b are computed only once, for all shifts.
 
-        block_length = min(self.block_length, n_points)
+        Parameters
+        ----------
+        sigs_a : array, shape (n_signals_a, n_epochs, n_points)
+            Signal which is rolled. Each signal is rolled as a ravelled
+            array, i.e. the epochs are rolled together.
 
-        window = self.wfunc(block_length)
-        n_freq = fft_length // 2 + 1
-        coherence = np.zeros((n_signals_a, n_signals_b, n_freq),
-                             dtype=np.complex128)
-        norm_a = np.zeros((n_signals_a, n_freq), dtype=np.float64)
-        norm_b = np.zeros((n_signals_b, n_freq), dtype=np.float64)
+        sigs_b : array, shape (n_signals_b, n_epochs, n_points)
+            Signal which is not rolled
 
-        # iterate on blocks
-        count = 0
-        for i_epoch in range(n_epochs):
-            block = np.arange(block_length)
-            while block[-1] < n_points:
+        shifts : array or list of int, shape (n_shifts, )
+            Shifts applied on sigs_a
 
-                for i_a in range(n_signals_a):
-                    F_a = sp.fft(window * sigs_a[i_a, i_epoch, block],
-                                 fft_length, 0)[:n_freq]
-                    norm_a[i_a] += square(F_a)
+        Returns
+        -------
+        coherence : array, shape (n_shifts, n_signals_a, n_signals_b, n_freqs)
+            Complex coherence of rolled sigs_a and sigs_b over all epochs.
+            n_freqs = fft_length // 2 + 1
+        """
+        self._check_shapes(sigs_a, sigs_b)
+        spectra_b, norm_b = self._spectra(sigs_b, conjugate=True)
+
+        # the rolled signals are written in the same buffer for all shifts
+        ravelled_a = sigs_a.reshape(sigs_a.shape[0], -1)
+        buffer_a = np.empty(ravelled_a.shape, dtype=ravelled_a.dtype)
+        coherence = []
+        for shift in shifts:
+            rolled_a = sigs_a
+            if shift != 0:
+                roll(ravelled_a, shift, axis=-1, out=buffer_a)
+                rolled_a = buffer_a.reshape(sigs_a.shape)
+            coherence.append(self._cross_coherence(rolled_a, spectra_b,
+                                                   norm_b))
+
+        self.coherence = np.array(coherence)
+        return self.coherence
 
-                    for i_b in range(n_signals_b):
-                        F_b = sp.fft(window * sigs_b[i_b, i_epoch, block],
-                                     fft_length, 0)[:n_freq]
-                        # compute only once
-                        if i_a == 0:
-                            norm_b[i_b] += square(F_b)
+    def _check_shapes(self, sigs_a, sigs_b):
+        if sigs_a.ndim != 3 or sigs_b.ndim != 3 or (sigs_a.shape[1:] !=
+                                                    sigs_b.shape[1:]):
+            raise ValueError('Incompatible shapes: %s and %s' %
+                             (sigs_a.shape, sigs_b.shape))
 
-                        coherence[i_a, i_b] += F_a * np.conjugate(F_b)
+    def _spectra(self, sigs, conjugate=False):
+        """Computes the spectra of all blocks of each epoch
 
-                count = count + 1
-                block = block + step
+        Returns
+        -------
+        spectra : list of array, shape (n_freq, n_signals, n_blocks)
+            Spectra of each epoch. If conjugate is True, the spectra are
+            conjugated, with shape (n_freq, n_blocks, n_signals).
 
-        normalization = np.sqrt(norm_a[:, None, :] * norm_b[None, :, :])
-        coherence /= normalization
+        norm : array, shape (n_signals, n_freq)
+            Power spectra summed over all blocks and epochs
+        """
+        fft_length, step = self.check_params()
+        n_signals, n_epochs, n_points = sigs.shape
+        window = self.wfunc(min(self.block_length, n_points))
 
-        if count == 0:
-            raise IndexError(
-                'bicoherence: first block needs %d samples but sigs has shape '
-                '%s' % (block_length, sigs_a.shape))
+        spectra = []
+        norm = np.zeros((n_signals, fft_length // 2 + 1))
+        for i_epoch in range(n_epochs):
+            # n_signals, n_blocks, n_freq = F.shape
+            F = block_spectra(sigs[:, i_epoch], window, fft_length, step)
+            norm += square(F).sum(axis=1)
+            if conjugate:
+                spectra.append(np.conjugate(F).transpose(2, 1, 0))
+            else:
+                spectra.append(F.transpose(2, 0, 1))
+        return spectra, norm
 
-        self.coherence = coherence
-        return self.coherence
+    def _cross_coherence(self, sigs_a, spectra_b, norm_b):
+        """Computes the coherence between sigs_a and precomputed (and
+        conjugated) spectra of sigs_b"""
+        spectra_a, norm_a = self._spectra(sigs_a)
+
+        # cross-spectra summed over blocks, with one product per freq
+        coherence = 0
+        for F_a, F_b in zip(spectra_a, spectra_b):
+            coherence = coherence + np.matmul(F_a, F_b)
+        coherence = coherence.transpose(1, 2, 0)
+
+        normalization = np.sqrt(norm_a[:, None, :] * norm_b[None, :, :])
+        coherence /= normalization
+        return coherence
 
     def plot(self, fig=None, ax=None):
         """Not Implemented"""
@@ -373,7 +411,8 @@ class Bicoherence(Spectrum):
               self).__init__(block_length=block_length, fft_length=fft_length,
                              step=step, wfunc=wfunc, fs=fs)
 
-    def fit(self, sigs, method='hagihira'):
+    def fit(self, sigs, method='hagihira', high_fq_range=None,
+            low_fq_range=None):
         """
         Computes the bicoherence for one signal
 
@@ -385,15 +424,31 @@ class Bicoherence(Spectrum):
         method : string in ('hagihira', 'sigl', 'nagashima', 'bispectrum')
             Normalization used for the bicoherence
 
+        high_fq_range : array or None, shape (n_high, )
+            Frequencies of interest (in Hz) for the first frequency f1.
+            Only the frequency bins needed to linearly interpolate between
+            the extreme values are computed. If None, all bins are computed.
+
+        low_fq_range : array or None, shape (n_low, )
+            Frequencies of interest (in Hz) for the second frequency f2.
+            Only the frequency bins needed to linearly interpolate between
+            the extreme values are computed. If None, all bins are computed.
+
         Returns
         -------
         bicoherence : array, shape (n_freq, n_freq)
-            Complex bicoherence computed on the input signal.
+            Bicoherence computed on the input signal.
             n_freq = fft_length // 2 + 1
+            Only the non-redundant part, where f2 <= f1 and f1 + f2 < n_freq,
+            is computed, inside the frequency ranges of interest. The rest is
+            set to zero.
         """
         fft_length, step = self.check_params()
         self.method = method
 
+        if method not in ('sigl', 'nagashima', 'hagihira', 'bispectrum'):
+            raise ValueError("Method '%s' unkown." % method)
+
         sigs = np.atleast_2d(sigs)
         n_epochs, n_points = sigs.shape
 
@@ -401,55 +456,69 @@ class Bicoherence(Spectrum):
 
         window = self.wfunc(block_length)
         n_freq = fft_length // 2 + 1
-        bicoherence = np.zeros((n_freq, n_freq), dtype=np.complex128)
-        normalization = np.zeros((n_freq, n_freq), dtype=np.float64)
 
-        # iterate on blocks
-        count = 0
-        for i_epoch in range(n_epochs):
-            block = np.arange(block_length)
-            while block[-1] < n_points:
-                F = sp.fft(window * sigs[i_epoch, block], fft_length,
-                           0)[:n_freq]
-                F1 = F[None, :]
-                F2 = F1.T
-                mask = hankel(np.arange(n_freq))
-                F12 = np.conjugate(F)[mask]
-
-                product = F1 * F2 * F12
-                bicoherence += product
-                if method == 'sigl':
-                    normalization += square(F1) * square(F2) * square(F12)
-                elif method == 'nagashima':
-                    normalization += square(F1 * F2) * square(F12)
-                elif method == 'hagihira':
-                    normalization += np.abs(product)
-                elif method == 'bispectrum':
-                    pass
-                else:
-                    raise (ValueError("Method '%s' unkown." % method))
-
-                count = count + 1
-                block = block + step
-
-        bicoherence = np.real(np.abs(bicoherence))
+        # spectra of all blocks of all epochs, with one batched FFT
+        spectra = block_spectra(sigs, window, fft_length, step)
+        spectra = spectra.reshape(-1, n_freq)
+        n_blocks = spectra.shape[0]
+
+        # only the non-redundant part is computed, i.e. the frequency pairs
+        # (f1, f2) with f2 <= f1 and f1 + f2 < n_freq, restricted to the
+        # frequency ranges of interest
+        bins_1 = self._frequency_bins(high_fq_range, fft_length)
+        bins_2 = self._frequency_bins(low_fq_range, fft_length)
+        f1, f2 = np.meshgrid(bins_1, bins_2, indexing='ij')
+        keep = np.logical_and(f2 <= f1, f1 + f2 < n_freq)
+        f1, f2 = f1[keep], f2[keep]
+        f12 = f1 + f2
+
+        # accumulate the triple products by chunks of blocks, to bound memory
+        chunk_size = max(1, BICOHERENCE_CHUNK_SIZE // f1.size)
+        bispectrum = np.zeros(f1.size, dtype=np.complex128)
+        normalization = np.zeros(f1.size, dtype=np.float64)
+        for start in range(0, n_blocks, chunk_size):
+            F = spectra[start:start + chunk_size]
+            F1, F2, F12 = F[:, f1], F[:, f2], np.conjugate(F[:, f12])
+
+            product = F1 * F2 * F12
+            bispectrum += product.sum(axis=0)
+            if method == 'sigl':
+                normalization += (square(F1) * square(F2) *
+                                  square(F12)).sum(axis=0)
+            elif method == 'nagashima':
+                normalization += (square(F1 * F2) * square(F12)).sum(axis=0)
+            elif method == 'hagihira':
+                normalization += np.abs(product).sum(axis=0)
+
+        bispectrum = np.abs(bispectrum)
 
         if method in ['sigl', 'nagashima']:
             normalization = np.sqrt(normalization)
 
         if method != 'bispectrum':
-            bicoherence /= normalization
+            bispectrum /= normalization
         else:
-            bicoherence = np.log(bicoherence)
+            bispectrum = np.log(bispectrum)
 
-        if count == 0:
-            raise IndexError(
-                'bicoherence: first block needs %d samples but sigs has shape '
-                '%s' % (self.block_length, sigs.shape))
+        # the redundant part is set to zero
+        bicoherence = np.zeros((n_freq, n_freq), dtype=np.float64)
+        bicoherence[f1, f2] = bispectrum
 
         self.bicoherence = bicoherence
         return bicoherence
 
+    def _frequency_bins(self, fq_range, fft_length):
+        """Frequency bins needed to interpolate over fq_range"""
+        n_freq = fft_length // 2 + 1
+        if fq_range is None:
+            return np.arange(n_freq)
+
+        fq_range = np.asarray(fq_range, dtype=np.float64) * fft_length
+        fq_range /= self.fs
+        first = int(np.clip(np.floor(fq_range.min()), 0, n_freq - 1))
+        last = int(np.clip(np.ceil(fq_range.max()), 0, n_freq - 1))
+        return np.arange(first, last + 1)
+
     def plot(self, fig=None, ax=None):
         if fig is None:
             fig = plt.figure()
@@ -457,11 +526,8 @@ class Bicoherence(Spectrum):
             ax = fig.gca()
 
         fmax = self.fs / 2.0
-        bicoherence = np.copy(self.bicoherence)
-        n_freq = bicoherence.shape[0]
-        np.flipud(bicoherence)[np.triu_indices(n_freq, 1)] = 0
-        bicoherence[np.triu_indices(n_freq, 1)] = 0
-        bicoherence = bicoherence[:, :n_freq // 2 + 1]
+        n_freq = self.bicoherence.shape[0]
+        bicoherence = self.bicoherence[:, :n_freq // 2 + 1]
 
         vmin, vmax = compute_vmin_vmax(bicoherence, tick=1e-15, percentile=1)
         ax.imshow(bicoherence, cmap=plt.cm.viridis, aspect='auto', vmin=vmin,
@@ -477,37 +543,153 @@ class Bicoherence(Spectrum):
         pass
 
 
-def phase_amplitude(signals, phase=True, amplitude=True):
-    """Extract instantaneous phase and amplitude with Hilbert transform"""
-    # one dimension array
-    if signals.ndim == 1:
-        signals = signals[None, :]
-        one_dim = True
-    elif signals.ndim == 2:
-        one_dim = False
-    else:
-        raise ValueError('Impossible to compute phase_amplitude with ndim ='
-                         ' %s.' % (signals.ndim, ))
+def strided_blocks(signals, block_length, step):
+    """Return a view on all the successive blocks of the signals
 
-    n_epochs, n_points = signals.shape
-    n_fft = compute_n_fft(signals)
+    Parameters
+    ----------
+    signals : array, shape (..., n_points)
+        Input signals
 
-    sig_phase = np.empty(signals.shape) if phase else None
-    sig_amplitude = np.empty(signals.shape) if amplitude else None
-    for i, sig in enumerate(signals):
-        sig_complex = hilbert(sig, n_fft)[:n_points]
+    block_length : int
+        Length of each block, smaller or equal to n_points
 
-        if phase:
-            sig_phase[i] = np.angle(sig_complex)
-        if amplitude:
-            sig_amplitude[i] = np.abs(sig_complex)
+    step : int
+        Step between successive blocks
+
+    Returns
+    -------
+    blocks : array, shape (..., n_blocks, block_length)
+        Read-only view on the blocks, without copy.
+        n_blocks = (n_points - block_length) // step + 1
+    """
+    signals = np.asarray(signals)
+    n_points = signals.shape[-1]
+    if block_length > n_points:
+        raise IndexError('first block needs %d samples but signals has shape '
+                         '%s' % (block_length, signals.shape))
+    n_blocks = (n_points - block_length) // step + 1
+    stride = signals.strides[-1]
+    blocks = np.lib.stride_tricks.as_strided(
+        signals, shape=signals.shape[:-1] + (n_blocks, block_length),
+        strides=signals.strides[:-1] + (step * stride, stride))
+    blocks.flags.writeable = False
+    return blocks
+
+
+def block_spectra(signals, window, fft_length, step):
+    """Compute the windowed FFT of all the successive blocks of the signals
+
+    Parameters
+    ----------
+    signals : array, shape (..., n_points)
+        Input signals
+
+    window : array, shape (block_length, )
+        Weighting window applied on each block
+
+    fft_length : int
+        Length of the FFT, greater or equal to block_length
+
+    step : int
+        Step between successive blocks
 
-    # one dimension array
-    if one_dim:
+    Returns
+    -------
+    spectra : array, shape (..., n_blocks, n_freq)
+        Complex spectra of the blocks, with n_freq = fft_length // 2 + 1
+    """
+    blocks = strided_blocks(signals, window.size, step) * window
+    if np.iscomplexobj(blocks):
+        n_freq = fft_length // 2 + 1
+        return np.fft.fft(blocks, fft_length, axis=-1)[..., :n_freq]
+    return np.fft.rfft(blocks, fft_length, axis=-1)
+
+
+def phase_amplitude(signals, phase=True, amplitude=True, dtype=np.float64,
+                    out=None):
+    """Extract instantaneous phase and amplitude with Hilbert transform
+
+    The analytic signals are computed with batched calls to hilbert along
+    the last axis, on chunks of signals to bound the memory, and written
+    directly in the outputs.
+
+    Parameters
+    ----------
+    signals : array, shape (..., n_points)
+        Input signals
+
+    phase : boolean
+        If True, compute the instantaneous phase
+
+    amplitude : boolean
+        If True, compute the instantaneous amplitude
+
+    dtype : np.float64 or np.float32
+        Data type of the outputs, when they are not given in out
+
+    out : None or tuple of two arrays (or None), shape (..., n_points)
+        Arrays in which the phase and the amplitude are stored, to avoid
+        allocating the outputs. None entries are allocated with dtype. The
+        given arrays should be C-contiguous, and their dtype overrides the
+        dtype parameter.
+
+    Returns
+    -------
+    sig_phase : array or None, shape (..., n_points)
+        Instantaneous phase, or None if phase is False
+
+    sig_amplitude : array or None, shape (..., n_points)
+        Instantaneous amplitude, or None if amplitude is False
+    """
+    signals = np.asarray(signals)
+    if signals.ndim == 0:
+        raise ValueError('Impossible to compute phase_amplitude with ndim ='
+                         ' %s.' % (signals.ndim, ))
+    if out is None:
+        out = (None, None)
+    sig_phase, sig_amplitude = out
+    for name, array in zip(('phase', 'amplitude'), out):
+        if array is None:
+            continue
+        if array.shape != signals.shape:
+            raise ValueError('The %s output has shape %s, while the signals '
+                             'have shape %s.' % (name, array.shape,
+                                                 signals.shape))
+        if not array.flags.c_contiguous:
+            raise ValueError('The %s output should be C-contiguous.' % name)
+
+    if phase:
+        if sig_phase is None:
+            sig_phase = np.empty(signals.shape, dtype=dtype)
+    else:
+        sig_phase = None
+    if amplitude:
+        if sig_amplitude is None:
+            sig_amplitude = np.empty(signals.shape, dtype=dtype)
+    else:
+        sig_amplitude = None
+
+    # views of shape (n_signals, n_points), to process chunks of signals
+    n_points = signals.shape[-1]
+    n_fft = compute_n_fft(signals)
+    signals_2d = signals.reshape(-1, n_points)
+    if phase:
+        phase_2d = sig_phase.reshape(-1, n_points)
+    if amplitude:
+        amplitude_2d = sig_amplitude.reshape(-1, n_points)
+
+    chunk_size = max(1, PHASE_AMPLITUDE_CHUNK_SIZE // n_fft)
+    for start in range(0, signals_2d.shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        sig_complex = hilbert(signals_2d[chunk], n_fft,
+                              axis=-1)[:, :n_points]
         if phase:
-            sig_phase = sig_phase[0]
+            # same as np.angle, but with an output array
+            np.arctan2(sig_complex.imag, sig_complex.real,
+                       out=phase_2d[chunk])
         if amplitude:
-            sig_amplitude = sig_amplitude[0]
+            np.abs(sig_complex, out=amplitude_2d[chunk])
 
     return sig_phase, sig_amplitude
 
@@ -0,0 +1,32 @@
+import numpy as np
+
+from pactools.utils.testing import assert_array_almost_equal
+from pactools.utils.arma import ai2ki, ki2ai
+
+
+def _ki2ai_loop(parcor):
+    # reference Levinson recurrence, one model at a time
+    ar = np.zeros(parcor.shape[0])
+    for i, k in enumerate(parcor):
+        ar[:i] = ar[:i] + k * ar[:i][::-1]
+        ar[i] = k
+    return ar
+
+
+def test_ki2ai_ai2ki():
+    # Test the Levinson recurrences on arrays of different shapes
+    rng = np.random.RandomState(0)
+    ordar = 6
+    for shape in [(ordar, ), (ordar, 7), (ordar, 3, 7)]:
+        parcor = np.tanh(rng.randn(*shape))
+        ar = ki2ai(parcor)
+        assert_array_almost_equal(ai2ki(ar), parcor)
+
+        ar_ref = np.apply_along_axis(_ki2ai_loop, 0, parcor)
+        assert_array_almost_equal(ar, ar_ref)
+
+        # the input is not modified
+        parcor_copy = np.copy(parcor)
+        ai2ki(ar)
+        ki2ai(parcor)
+        assert_array_almost_equal(parcor, parcor_copy)
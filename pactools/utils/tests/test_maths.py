@@ -1,7 +1,7 @@
 import numpy as np
 
 from pactools.utils.maths import norm, squared_norm, argmax_2d, is_power2
-from pactools.utils.maths import prime_factors
+from pactools.utils.maths import prime_factors, roll, circular_dot
 from pactools.utils.testing import assert_equal
 from pactools.utils.testing import assert_array_almost_equal
 from pactools.utils.testing import assert_true, assert_false
@@ -33,3 +33,19 @@ def test_prime_factors():
     for n in range(3, 200, 2):
         factors = prime_factors(n)
         assert_equal(np.product(factors), n)
+
+
+def test_roll():
+    # Test that roll and circular_dot are consistent with np.roll
+    rng = np.random.RandomState(0)
+    x = rng.randn(3, 10)
+    for shift in (0, 1, -3, 10, 27):
+        assert_array_almost_equal(roll(x, shift), np.roll(x, shift))
+        for axis in (0, 1, -1):
+            out = np.empty_like(x)
+            roll(x, shift, axis=axis, out=out)
+            assert_array_almost_equal(out, np.roll(x, shift, axis=axis))
+
+        a, b = rng.randn(10), rng.randn(10) + 1j * rng.randn(10)
+        assert_array_almost_equal(circular_dot(a, b, shift),
+                                  np.dot(a, np.roll(b, shift)))
@@ -1,6 +1,7 @@
 import numpy as np
 
 from pactools.utils.parallel import _FakeParallel, _fake_delayed
+from pactools.utils.parallel import _fake_effective_n_jobs
 from pactools.utils.testing import assert_array_equal, assert_equal
 
 
@@ -23,3 +24,9 @@ def test_fake_delayed():
     # Test that fake_delayed does nothing but returning the input arg
     assert_equal(twice, _fake_delayed(twice))
     assert_equal(42, _fake_delayed(42))
+
+
+def test_fake_effective_n_jobs():
+    # Test that _fake_effective_n_jobs always returns one job
+    for n_jobs in [1, 4, -1, -2]:
+        assert_equal(_fake_effective_n_jobs(n_jobs), 1)
@@ -0,0 +1,184 @@
+import numpy as np
+
+from pactools.utils import spectrum
+from pactools.utils.spectrum import Spectrum, Coherence, Bicoherence
+from pactools.utils.spectrum import strided_blocks, phase_amplitude
+from pactools.utils.testing import assert_equal, assert_raises
+from pactools.utils.testing import assert_array_almost_equal, assert_true
+
+
+def _periodogram_loop(sig, block_length, fft_length, step):
+    """Reference Welch periodogram, block by block"""
+    window = np.hamming(block_length)
+    n_freq = fft_length // 2 + 1
+    psd = np.zeros(n_freq)
+    count = 0
+    start = 0
+    while start + block_length <= sig.size:
+        block = window * sig[start:start + block_length]
+        psd += np.abs(np.fft.fft(block, fft_length)[:n_freq]) ** 2
+        count += 1
+        start += step
+    return psd / (count * np.sum(window) ** 2)
+
+
+def test_strided_blocks():
+    # Test the blocks against slices of the signal
+    sig = np.arange(30.).reshape(2, 15)
+    blocks = strided_blocks(sig, 4, 3)
+    assert_equal(blocks.shape, (2, 4, 4))
+    for i_block in range(4):
+        assert_array_almost_equal(blocks[:, i_block],
+                                  sig[:, 3 * i_block:3 * i_block + 4])
+    assert_raises(IndexError, strided_blocks, sig, 16, 3)
+
+
+def test_periodogram():
+    # Test the vectorized periodogram against a loop over blocks
+    rng = np.random.RandomState(0)
+    signals = rng.randn(3, 1000)
+    for block_length, fft_length, step in [(128, 256, 50), (100, 128, 100),
+                                           (256, 256, 128)]:
+        spec = Spectrum(block_length=block_length, fft_length=fft_length,
+                        step=step)
+        psd = spec.periodogram(signals)
+        assert_equal(psd.shape, (3, fft_length // 2 + 1))
+        for sig, this_psd in zip(signals, psd):
+            assert_array_almost_equal(
+                this_psd, _periodogram_loop(sig, block_length, fft_length,
+                                            step))
+
+
+def test_coherence():
+    # Test the batched coherence against a loop over blocks and signals
+    rng = np.random.RandomState(0)
+    sigs_a = rng.randn(2, 3, 500)
+    sigs_b = rng.randn(4, 3, 500) + sigs_a[:1]
+    block_length, step = 128, 64
+    coherence = Coherence(block_length=block_length, step=step).fit(sigs_a,
+                                                                    sigs_b)
+    assert_equal(coherence.shape, (2, 4, 65))
+
+    window = np.hamming(block_length)
+    starts = range(0, 500 - block_length + 1, step)
+    for i_a, sig_a in enumerate(sigs_a):
+        for i_b, sig_b in enumerate(sigs_b):
+            cross, norm_a, norm_b = 0, 0, 0
+            for i_epoch in range(3):
+                for start in starts:
+                    sl = slice(start, start + block_length)
+                    F_a = np.fft.rfft(window * sig_a[i_epoch, sl])
+                    F_b = np.fft.rfft(window * sig_b[i_epoch, sl])
+                    cross += F_a * np.conj(F_b)
+                    norm_a += np.abs(F_a) ** 2
+                    norm_b += np.abs(F_b) ** 2
+            assert_array_almost_equal(coherence[i_a, i_b],
+                                      cross / np.sqrt(norm_a * norm_b))
+
+
+def test_coherence_fit_shifts():
+    # Test that fit_shifts is identical to fit on the rolled signals
+    rng = np.random.RandomState(0)
+    sigs_a = rng.randn(1, 2, 300)
+    sigs_b = rng.randn(3, 2, 300)
+    shifts = [0, 17, 250]
+    model = Coherence(block_length=64)
+    coherence = model.fit_shifts(sigs_a, sigs_b, shifts)
+    assert_equal(coherence.shape, (3, 1, 3, 33))
+
+    for shift, this_coherence in zip(shifts, coherence):
+        rolled_a = np.roll(sigs_a[0], shift)[None]
+        assert_array_almost_equal(this_coherence,
+                                  Coherence(block_length=64).fit(rolled_a,
+                                                                 sigs_b))
+
+
+def test_bicoherence():
+    # Test the batched bicoherence against a loop over blocks
+    rng = np.random.RandomState(0)
+    sigs = rng.randn(2, 300)
+    block_length = 32
+    window = np.hamming(block_length)
+    n_freq = block_length // 2 + 1
+    bispectrum = np.zeros((n_freq, n_freq), dtype=np.complex128)
+    normalization = np.zeros((n_freq, n_freq))
+    for sig in sigs:
+        for start in range(0, 300 - block_length + 1, block_length // 2):
+            F = np.fft.rfft(window * sig[start:start + block_length])
+            for f1 in range(n_freq):
+                for f2 in range(min(f1, n_freq - 1 - f1) + 1):
+                    product = F[f1] * F[f2] * np.conj(F[f1 + f2])
+                    bispectrum[f1, f2] += product
+                    normalization[f1, f2] += np.abs(product)
+    kept = normalization > 0
+
+    # use small chunks of blocks to test the accumulation
+    chunk_size = spectrum.BICOHERENCE_CHUNK_SIZE
+    spectrum.BICOHERENCE_CHUNK_SIZE = 400
+    try:
+        bicoherence = Bicoherence(block_length=block_length).fit(
+            sigs, method='hagihira')
+    finally:
+        spectrum.BICOHERENCE_CHUNK_SIZE = chunk_size
+    assert_array_almost_equal(bicoherence[kept],
+                              np.abs(bispectrum[kept]) / normalization[kept])
+    assert_array_almost_equal(bicoherence[~kept], 0)
+
+    assert_raises(ValueError, Bicoherence().fit, sigs, method='foo')
+
+
+def test_bicoherence_frequency_ranges():
+    # Test that restricting the frequency ranges only skips some bins
+    rng = np.random.RandomState(0)
+    sigs = rng.randn(2, 500)
+    model = Bicoherence(block_length=64, fs=64.)
+    bicoherence = model.fit(sigs)
+    bicoherence_band = model.fit(sigs, high_fq_range=[10.5, 20.],
+                                 low_fq_range=[2., 4.2])
+
+    computed = np.zeros(bicoherence.shape, dtype=bool)
+    computed[10:21, 2:6] = True
+    assert_array_almost_equal(bicoherence_band[computed],
+                              bicoherence[computed])
+    assert_array_almost_equal(bicoherence_band[~computed], 0)
+
+
+def test_phase_amplitude():
+    # Test the batched computation against one signal at a time
+    rng = np.random.RandomState(0)
+    signals = rng.randn(2, 3, 101)
+    sig_phase, sig_amplitude = phase_amplitude(signals)
+    assert_equal(sig_phase.shape, signals.shape)
+    for sig, this_phase, this_amplitude in zip(
+            signals.reshape(-1, 101), sig_phase.reshape(-1, 101),
+            sig_amplitude.reshape(-1, 101)):
+        phase_1d, amplitude_1d = phase_amplitude(sig)
+        assert_array_almost_equal(this_phase, phase_1d)
+        assert_array_almost_equal(this_amplitude, amplitude_1d)
+
+    # float32 outputs, and output buffers
+    sig_phase_32, sig_amplitude_32 = phase_amplitude(signals, dtype=np.float32)
+    assert_equal(sig_amplitude_32.dtype, np.float32)
+    assert_array_almost_equal(sig_amplitude_32, sig_amplitude, decimal=5)
+    buffer = np.empty(signals.shape)
+    result = phase_amplitude(signals, phase=False, out=(None, buffer))
+    assert_true(result[0] is None)
+    assert_true(result[1] is buffer)
+    assert_array_almost_equal(buffer, sig_amplitude)
+    buffer_32 = np.empty(signals.shape, dtype=np.float32)
+    phase_amplitude(signals, phase=False, out=(None, buffer_32))
+    assert_array_almost_equal(buffer_32, sig_amplitude, decimal=5)
+    assert_raises(ValueError, phase_amplitude, signals,
+                  out=(np.empty((2, 3, 100)), None))
+    assert_raises(ValueError, phase_amplitude, signals,
+                  out=(None, np.empty((2, 101, 3)).swapaxes(1, 2)))
+
+    # chunks of signals give the same result
+    chunk_size = spectrum.PHASE_AMPLITUDE_CHUNK_SIZE
+    spectrum.PHASE_AMPLITUDE_CHUNK_SIZE = 500
+    try:
+        sig_phase_chunk, sig_amplitude_chunk = phase_amplitude(signals)
+    finally:
+        spectrum.PHASE_AMPLITUDE_CHUNK_SIZE = chunk_size
+    assert_array_almost_equal(sig_phase_chunk, sig_phase)
+    assert_array_almost_equal(sig_amplitude_chunk, sig_amplitude)
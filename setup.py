@@ -1,5 +1,4 @@
-import setuptools  # noqa  # used with `python setup.py develop`
-from distutils.core import setup
+from setuptools import setup
 
 descr = """Estimation of phase-amplitude coupling (PAC) in neural time series,
            including with driven auto-regressive (DAR) models."""
@@ -18,4 +17,7 @@ setup(
         'pactools',
         'pactools.dar_model',
         'pactools.utils',
-    ], )
+    ],
+    # numba compiles the loop kernels of the lattice filters and of the
+    # peak finder, which otherwise run with a slower NumPy fallback
+    extras_require={'numba': ['numba']}, )